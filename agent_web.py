@@ -1,18 +1,33 @@
 # agent_web.py - DID-Enabled Agent Web SDK (v4)
+#
+# Only what every agent needs (signing, sending) is imported here. The listener
+# stack (FastAPI, uvicorn) and the DHT (kademlia) are imported where they are
+# first used, so send-only processes never pay for them. Keep it that way:
+# benchmarks/bench_import_time.py fails if they creep back into module import.
 import asyncio
 import httpx
-import uvicorn
-from fastapi import FastAPI, Request, HTTPException
 from pydantic import BaseModel
-from typing import Callable, Dict, Any, List, Optional
+from typing import TYPE_CHECKING, AsyncIterator, Callable, Dict, Any, List, Optional
 import time
 import json
 import base64
 import os
 import hashlib  # NEW: For DID generation
-
-# Kademlia (DHT) import
-from kademlia.network import Server as KademliaServer
+import functools
+import bisect
+import math
+import inspect
+import contextvars
+import socket
+import struct
+import random
+import ipaddress
+import weakref
+from collections import OrderedDict
+from urllib.parse import urlparse
+
+if TYPE_CHECKING:
+    from kademlia.network import Server as KademliaServer
 
 # Cryptography imports
 from cryptography.hazmat.primitives import serialization, hashes
@@ -29,6 +44,11 @@ class Payload(BaseModel):
     sender_did: str  # RENAMED from sender_id
     body: Dict[str, Any]
     timestamp: float
+    idempotency_key: Optional[str] = None  # Retries with the same key get the stored response
+    deadline: Optional[float] = None  # Absolute unix time after which the caller has given up
+    task_id: Optional[str] = None  # Async task submitted to /tasks, or whose result an /invoke reports
+    callback: Optional[bool] = None  # Submitter listens for a pushed result instead of only polling
+    capability: Optional[str] = None  # Capability the caller asked for; selects the route (see Agent.route)
 
 class AgentRecord(BaseModel):
     # This now contains the pubkey so we can verify the DID
@@ -36,6 +56,18 @@ class AgentRecord(BaseModel):
     endpoint: str
     price: float
     payment_method: str
+    uds_path: Optional[str] = None  # Unix socket for callers on the same host
+    cacheable: bool = False  # Responses are safe for callers to cache
+    cache_ttl: float = 0.0  # Max seconds a cached response stays valid (0 = caller decides)
+    seq: int = 0  # Publication version (ms timestamp, strictly increasing per agent); 0 = unversioned
+
+class CachePolicy(BaseModel):
+    # Caller-side response caching for idempotent capabilities (opt-in)
+    enabled: bool = False
+    ttl: float = 30.0
+    max_entries: int = 1024
+    max_bytes: int = 4 * 1024 * 1024
+    require_advertised: bool = True  # Only cache agents that register as cacheable
 
 class ReputationStats(BaseModel):
     successes: int = 0
@@ -45,16 +77,1068 @@ class ReputationStats(BaseModel):
     success_rate: float = 0.0
     avg_response_time_ms: float = 0.0
     reputation_score: float = 5.0
+    load: Optional["AgentLoad"] = None  # Latest heartbeat, if the registry has a fresh one
+
+class AgentLoad(BaseModel):
+    # What an agent last reported in its heartbeat (see Agent.start_heartbeat)
+    in_flight: int = 0  # Handlers running
+    queued: int = 0  # Requests waiting for a route slot
+    p95_ms: float = 0.0  # Handler latency p95 since the previous heartbeat
+    interval: float = 0.0  # Seconds until the next heartbeat is due
+    reported_at: float = 0.0  # Registry receive time (unix)
+
+ReputationStats.model_rebuild()
+
+# --- Deadlines ---
+# The deadline of the request being handled, so nested send()/execute_task()
+# calls made from a handler inherit the caller's remaining budget.
+
+_current_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar(
+    "agent_web_deadline", default=None)
+
+def current_deadline() -> Optional[float]:
+    """Absolute unix deadline of the request being handled (None if unbounded)."""
+    return _current_deadline.get()
+
+def remaining_time() -> Optional[float]:
+    """Seconds left before current_deadline(); None if unbounded."""
+    deadline = _current_deadline.get()
+    return None if deadline is None else deadline - time.time()
+
+# The idempotency key of the request being handled. Unlike the deadline it is
+# not inherited: a handler forwards it (or a key derived from it) explicitly.
+_current_idempotency_key: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar(
+    "agent_web_idempotency_key", default=None)
+
+def current_idempotency_key() -> Optional[str]:
+    """Idempotency key the caller attached to the request being handled (None if it sent none)."""
+    return _current_idempotency_key.get()
+
+def _effective_deadline(deadline: Optional[float], timeout: Optional[float]) -> Optional[float]:
+    """The earliest of an explicit deadline, now + timeout and the inherited deadline."""
+    candidates = [d for d in (deadline, _current_deadline.get()) if d is not None]
+    if timeout is not None:
+        candidates.append(time.time() + timeout)
+    return min(candidates) if candidates else None
+
+class DeadlineExceeded(Exception):
+    """Raised by the listener when a request's deadline passes before or during handling."""
+
+# --- Streaming ---
+#
+# /invoke_stream answers with NDJSON lines {"seq", "data", "hash"}. The hash chain
+# starts at sha256(request signature) and each link is sha256(previous || canonical
+# JSON of the chunk), so chunks can't be dropped, reordered or replayed from another
+# call. The last line {"seq", "end": true, "hash", "signature"} signs the chain head.
+
+class StreamError(Exception):
+    """Raised by send_stream when a stream is broken, unsigned or reports a handler failure."""
+
+def _chain_hash(previous: bytes, data: Any) -> bytes:
+    canonical = json.dumps(data, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(previous + canonical.encode('utf-8')).digest()
+
+# --- Async Tasks ---
+#
+# submit() posts to /tasks and returns at once; the provider runs the job in the
+# background and pushes a signed {"task_id", "status", "result"|"error"} to the
+# submitter's /invoke (Payload.task_id set), or the submitter polls GET /tasks/{id}.
+
+_TASK_CALLBACK_ATTEMPTS = 3  # Result pushes to a task's submitter before leaving it to polling
+
+# --- Caching Helpers ---
+
+def _canonical_hash(body: Any) -> str:
+    """Stable sha256 of a JSON body: same content, same hash, regardless of key order."""
+    canonical = json.dumps(body, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+class _TTLCache:
+    """LRU cache with per-entry expiry, bounded by entry count and total bytes."""
+
+    def __init__(self, max_entries: int = 1024, max_bytes: int = 4 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[Any, tuple]" = OrderedDict()  # key -> (expires_at, size, value)
+        self._bytes = 0
+        self._next_sweep = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Any, count_miss: bool = True) -> Any:
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] <= time.monotonic():
+            self._remove(key)
+            entry = None
+        if entry is None:
+            if count_miss:
+                self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[2]
+
+    def put(self, key: Any, value: Any, ttl: float, size: int = 0):
+        if ttl <= 0 or size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (time.monotonic() + ttl, size, value)
+        self._bytes += size
+        self._evict()
+
+    def pop(self, key: Any) -> Any:
+        value = self.get(key, count_miss=False)
+        if value is not None:
+            self._remove(key)
+        return value
+
+    def clear(self):
+        self._entries.clear()
+        self._bytes = 0
+
+    def stats(self) -> Dict[str, int]:
+        return {"entries": len(self._entries), "bytes": self._bytes, "hits": self.hits,
+                "misses": self.misses, "evictions": self.evictions}
+
+    def _remove(self, key: Any):
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    def _evict(self):
+        # Drop expired entries (at most once a second), then least recently used until within bounds
+        now = time.monotonic()
+        if now >= self._next_sweep:
+            self._next_sweep = now + 1.0
+            for key in [k for k, (expires_at, _, _) in self._entries.items() if expires_at <= now]:
+                self._remove(key)
+        while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+
+def _is_cacheable_response(response: Any) -> bool:
+    """Only successful dict responses are worth caching."""
+    return isinstance(response, dict) and "error" not in response and response.get("status") != "error"
+
+def memoize_handler(ttl: float = 60.0, max_entries: int = 1024,
+                    max_bytes: int = 4 * 1024 * 1024, coalesce: bool = True):
+    """
+    Decorator that caches a message handler's results by canonical body hash.
+
+    Identical bodies get the same answer regardless of sender. Concurrent identical
+    requests share one handler call when `coalesce` is set. The wrapped handler
+    exposes `cache_stats()`, `cache_clear()` and `cache_lookup(body)`, which the
+    listener uses to answer hits without calling the handler at all.
+
+        @agent.on_message
+        @memoize_handler(ttl=300)
+        async def handle(sender_did, body): ...
+    """
+    def decorator(func: Callable) -> Callable:
+        cache = _TTLCache(max_entries, max_bytes)
+        in_flight: Dict[str, asyncio.Future] = {}
+        coalesced = 0
+
+        @functools.wraps(func)
+        async def wrapper(sender_did: str, body: Dict[str, Any]) -> Any:
+            nonlocal coalesced
+            key = _canonical_hash(body)
+            cached = cache.get(key)
+            if cached is not None:
+                return json.loads(cached)
+            if coalesce and key in in_flight:
+                coalesced += 1
+                return json.loads(await asyncio.shield(in_flight[key]))
+
+            future = asyncio.get_running_loop().create_future()
+            if coalesce:
+                in_flight[key] = future
+            try:
+                result = func(sender_did, body)
+                if hasattr(result, '__await__'):
+                    result = await result
+                encoded = json.dumps(result, default=str)
+                if _is_cacheable_response(result):
+                    cache.put(key, encoded, ttl, size=len(encoded))
+                future.set_result(encoded)
+                return result
+            except BaseException as e:
+                future.set_exception(e)
+                future.exception()  # Waiters re-raise it; don't log it as unretrieved
+                raise
+            finally:
+                in_flight.pop(key, None)
+
+        def cache_lookup(body: Dict[str, Any]) -> Optional[Any]:
+            cached = cache.get(_canonical_hash(body), count_miss=False)
+            return json.loads(cached) if cached is not None else None
+
+        def cache_stats() -> Dict[str, int]:
+            return {**cache.stats(), "coalesced": coalesced}
+
+        wrapper.cache_lookup = cache_lookup
+        wrapper.cache_stats = cache_stats
+        wrapper.cache_clear = cache.clear
+        return wrapper
+
+    return decorator
+
+# --- Compact DHT Record Encoding ---
+# Records travel in single UDP datagrams, so they are stored as:
+#   b"AW" | version (1 byte) | fields
+# where each field is type (1 byte) | length (2 bytes, big-endian) | value.
+# Unknown field types are skipped, so newer fields don't break older readers.
+# The public key is DER instead of PEM; the PEM (and so the DID) is rebuilt on decode.
+
+_RECORD_MAGIC = b"AW"
+_RECORD_VERSION = 1
+
+_F_PUBLIC_KEY = 0x01  # SubjectPublicKeyInfo DER
+_F_ENDPOINT = 0x02  # See _pack_endpoint
+_F_PRICE = 0x03  # >d
+_F_PAYMENT_METHOD = 0x04  # UTF-8
+_F_UDS_PATH = 0x05  # UTF-8
+_F_CACHE = 0x06  # >?d cacheable, cache_ttl; omitted when both are unset
+_F_SEQ = 0x07  # >Q
+
+_SCHEMES = ["http", "https"]
+_HOST_NAME, _HOST_IPV4, _HOST_IPV6 = 0, 4, 6
+
+def _pack_endpoint(endpoint: str) -> bytes:
+    """scheme (1) | host kind (1) | host | port (2, 0 = default) | path (rest, UTF-8)."""
+    url = urlparse(endpoint)
+    if url.scheme not in _SCHEMES or not url.hostname:
+        # Anything unusual is stored verbatim under a sentinel scheme
+        return b"\xff" + endpoint.encode("utf-8")
+    try:
+        address = ipaddress.ip_address(url.hostname)
+        host_kind = _HOST_IPV4 if address.version == 4 else _HOST_IPV6
+        host = address.packed
+    except ValueError:
+        host_kind = _HOST_NAME
+        host = bytes([len(url.hostname)]) + url.hostname.encode("utf-8")
+    path = endpoint.split(url.netloc, 1)[1]
+    return (bytes([_SCHEMES.index(url.scheme), host_kind]) + host
+            + struct.pack(">H", url.port or 0) + path.encode("utf-8"))
+
+def _unpack_endpoint(data: bytes) -> str:
+    if data[0] == 0xff:
+        return data[1:].decode("utf-8")
+    scheme, host_kind = _SCHEMES[data[0]], data[1]
+    if host_kind == _HOST_NAME:
+        end = 3 + data[2]
+        host = data[3:end].decode("utf-8")
+    else:
+        end = 2 + (4 if host_kind == _HOST_IPV4 else 16)
+        host = str(ipaddress.ip_address(data[2:end]))
+        if host_kind == _HOST_IPV6:
+            host = f"[{host}]"
+    port, = struct.unpack(">H", data[end:end + 2])
+    netloc = f"{host}:{port}" if port else host
+    return f"{scheme}://{netloc}{data[end + 2:].decode('utf-8')}"
+
+def _encode_record(record: AgentRecord) -> bytes:
+    """Packs an AgentRecord into the compact binary DHT format."""
+    public_key = serialization.load_pem_public_key(record.public_key_pem.encode("utf-8"))
+    fields = [
+        (_F_PUBLIC_KEY, public_key.public_bytes(
+            encoding=serialization.Encoding.DER,
+            format=serialization.PublicFormat.SubjectPublicKeyInfo)),
+        (_F_ENDPOINT, _pack_endpoint(record.endpoint)),
+        (_F_PRICE, struct.pack(">d", record.price)),
+        (_F_PAYMENT_METHOD, record.payment_method.encode("utf-8")),
+    ]
+    if record.uds_path:
+        fields.append((_F_UDS_PATH, record.uds_path.encode("utf-8")))
+    if record.cacheable or record.cache_ttl:
+        fields.append((_F_CACHE, struct.pack(">?d", record.cacheable, record.cache_ttl)))
+    if record.seq:
+        fields.append((_F_SEQ, struct.pack(">Q", record.seq)))
+
+    out = bytearray(_RECORD_MAGIC)
+    out.append(_RECORD_VERSION)
+    for field_type, value in fields:
+        out += struct.pack(">BH", field_type, len(value)) + value
+    return bytes(out)
+
+def _decode_record(raw) -> AgentRecord:
+    """
+    Unpacks a DHT value into an AgentRecord. Accepts the binary format and the
+    older JSON records (str or bytes), so nodes can be upgraded one at a time.
+    """
+    if isinstance(raw, str) or not raw.startswith(_RECORD_MAGIC):
+        return AgentRecord.model_validate_json(raw)
+    if raw[2] != _RECORD_VERSION:
+        raise ValueError(f"unsupported record version {raw[2]}")
+
+    fields = {}
+    offset = 3
+    while offset < len(raw):
+        field_type, length = struct.unpack_from(">BH", raw, offset)
+        offset += 3
+        fields[field_type] = raw[offset:offset + length]
+        offset += length
+    if offset != len(raw):
+        raise ValueError("truncated record")
+
+    public_key = serialization.load_der_public_key(fields[_F_PUBLIC_KEY])
+    record = AgentRecord(
+        public_key_pem=public_key.public_bytes(
+            encoding=serialization.Encoding.PEM,
+            format=serialization.PublicFormat.SubjectPublicKeyInfo).decode("utf-8"),
+        endpoint=_unpack_endpoint(fields[_F_ENDPOINT]),
+        price=struct.unpack(">d", fields[_F_PRICE])[0],
+        payment_method=fields[_F_PAYMENT_METHOD].decode("utf-8"),
+    )
+    if _F_UDS_PATH in fields:
+        record.uds_path = fields[_F_UDS_PATH].decode("utf-8")
+    if _F_CACHE in fields:
+        record.cacheable, record.cache_ttl = struct.unpack(">?d", fields[_F_CACHE])
+    if _F_SEQ in fields:
+        record.seq, = struct.unpack(">Q", fields[_F_SEQ])
+    return record
+
+# --- DHT Capability Index ---
+# capability -> DIDs is stored under "cap:<capability>:<shard>" keys. Each agent
+# writes itself into the shard picked by its DID, so a popular capability is
+# spread over _CAP_INDEX_SHARDS keys (and so over different nodes). A shard is a
+# packed list of (32-byte DID digest, 4-byte unix expiry) entries, capped at
+# _CAP_INDEX_MAX_ENTRIES so it stays inside one datagram.
+
+_CAP_INDEX_SHARDS = 8
+_CAP_INDEX_MAX_ENTRIES = 32
+_CAP_ENTRY = struct.Struct(">32sI")
+_DID_PREFIX = "did:agentweb:"
+
+def _cap_index_key(capability: str, shard: int) -> str:
+    return f"cap:{capability}:{shard}"
+
+def _cap_index_shard(did: str) -> int:
+    return hashlib.sha256(did.encode("utf-8")).digest()[0] % _CAP_INDEX_SHARDS
+
+def _pack_cap_entries(entries: Dict[str, int]) -> bytes:
+    """Keeps the entries that expire last, up to _CAP_INDEX_MAX_ENTRIES."""
+    newest = sorted(entries.items(), key=lambda item: item[1], reverse=True)[:_CAP_INDEX_MAX_ENTRIES]
+    return b"".join(_CAP_ENTRY.pack(bytes.fromhex(did[len(_DID_PREFIX):]), expires)
+                    for did, expires in newest)
+
+def _unpack_cap_entries(raw, now: float) -> Dict[str, int]:
+    """Returns {did: expiry} for unexpired entries; anything malformed yields nothing."""
+    if not isinstance(raw, bytes) or len(raw) % _CAP_ENTRY.size:
+        return {}
+    return {_DID_PREFIX + digest.hex(): expires
+            for digest, expires in _CAP_ENTRY.iter_unpack(raw) if expires > now}
+
+# --- DHT Node ---
+
+async def _start_kademlia_node(host: str, port: int, bootstrap_node: Optional[tuple] = None,
+                               label: str = "", state_file: Optional[str] = None,
+                               ksize: int = 20, alpha: int = 3,
+                               rpc_timeout: float = 5.0) -> "KademliaServer":
+    """
+    Starts a Kademlia node (shared by Agent.start_dht_node and AgentHost).
+
+    `ksize` is the bucket size / replication factor, `alpha` the number of
+    peers queried in parallel per lookup round, and `rpc_timeout` how long a
+    single peer may take to answer before it is treated as down.
+
+    If `state_file` holds a snapshot from a previous run, the node keeps its old
+    id, gets its stored records back and bootstraps from the saved contacts
+    (plus `bootstrap_node`) in parallel, so it doesn't start from an empty table.
+    """
+    from kademlia.network import Server as KademliaServer
+
+    snapshot = _load_dht_snapshot(state_file) if state_file else None
+    node_id = bytes.fromhex(snapshot["node_id"]) if snapshot else None
+
+    dht_node = KademliaServer(ksize=ksize, alpha=alpha, node_id=node_id)
+    await dht_node.listen(port, interface=host)
+    # rpcudp fixes the per-RPC wait at protocol construction; kademlia doesn't expose it
+    dht_node.protocol._wait_timeout = rpc_timeout
+
+    contacts = []
+    if snapshot:
+        _restore_dht_records(dht_node, snapshot)
+        contacts = [tuple(contact) for contact in snapshot["contacts"]]
+    if bootstrap_node and tuple(bootstrap_node) not in contacts:
+        contacts.append((bootstrap_node[0], bootstrap_node[1]))
+
+    if contacts:
+        # Join the existing network; kademlia pings all contacts concurrently
+        await dht_node.bootstrap(contacts)
+        if snapshot:
+            print(f"[DHT] Node {label} warm-started from {state_file}: "
+                  f"{len(snapshot['records'])} records, {len(contacts)} contacts, "
+                  f"{len(dht_node.bootstrappable_neighbors())} reachable")
+        else:
+            print(f"[DHT] Node {label} bootstrapped to {bootstrap_node}")
+    else:
+        print(f"[DHT] Node {label} started as bootstrap node")
+
+    print(f"[DHT] Node {label} listening on {host}:{port}")
+    return dht_node
+
+def _version_key(did: str) -> str:
+    """DHT key holding just the `seq` of the record published under `did`."""
+    return f"{did}#v"
+
+def _request_timeout(deadline: Optional[float], default: float = 10.0) -> float:
+    """Per-hop network timeout: the default, capped by what's left of the deadline."""
+    if deadline is None:
+        return default
+    return max(0.0, min(default, deadline - time.time()))
+
+def _discard_result(task: asyncio.Future):
+    """Done-callback for background lookups whose result nobody awaits."""
+    if not task.cancelled():
+        task.exception()
+
+async def _await_until(awaitable, deadline: Optional[float]):
+    """
+    Awaits `awaitable`, raising DeadlineExceeded once `deadline` passes. The
+    work isn't cancelled (it may hold kademlia lookups, see _hedged_lookup);
+    it finishes in the background, e.g. still filling the discovery cache.
+    """
+    if deadline is None:
+        return await awaitable
+    task = asyncio.ensure_future(awaitable)
+    done, _ = await asyncio.wait([task], timeout=max(0.0, deadline - time.time()))
+    if not done:
+        task.add_done_callback(_discard_result)
+        raise DeadlineExceeded("Deadline exceeded during discovery")
+    return task.result()
+
+# --- DHT Snapshots (warm restarts) ---
+# JSON file: node id, every routing-table contact, and locally stored records
+# with their age, so expiry carries over across the restart.
+
+def _save_dht_snapshot(dht_node: "KademliaServer", path: str):
+    """Atomically writes the node's routing-table contacts and stored records to `path`."""
+    from kademlia.storage import ForgetfulStorage
+
+    contacts = []
+    if dht_node.protocol is not None:
+        for bucket in dht_node.protocol.router.buckets:
+            contacts.extend([node.ip, node.port] for node in bucket.get_nodes())
+
+    records = []
+    now = time.monotonic()
+    if isinstance(dht_node.storage, ForgetfulStorage):
+        items = [(key, now - birthday, value) for key, (birthday, value) in dht_node.storage.data.items()]
+    else:
+        items = [(key, 0.0, value) for key, value in dht_node.storage]
+    for key, age, value in items:
+        if isinstance(value, bytes):
+            records.append({"key": key.hex(), "age": age, "bytes": base64.b64encode(value).decode('ascii')})
+        else:
+            records.append({"key": key.hex(), "age": age, "value": value})
+
+    snapshot = {"version": 1, "node_id": dht_node.node.id.hex(), "contacts": contacts, "records": records}
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(snapshot, f)
+    os.replace(tmp_path, path)
+
+def _load_dht_snapshot(path: str) -> Optional[Dict[str, Any]]:
+    """Reads a snapshot written by _save_dht_snapshot; None if missing or unreadable."""
+    try:
+        with open(path) as f:
+            snapshot = json.load(f)
+        if snapshot.get("version") != 1:
+            return None
+        return snapshot
+    except (OSError, ValueError) as e:
+        if os.path.exists(path):
+            print(f"[DHT] WARN: Ignoring unreadable snapshot {path}: {e}")
+        return None
+
+def _restore_dht_records(dht_node: "KademliaServer", snapshot: Dict[str, Any]):
+    """Puts snapshotted records back into local storage, oldest first, keeping their age."""
+    from kademlia.storage import ForgetfulStorage
+
+    now = time.monotonic()
+    forgetful = isinstance(dht_node.storage, ForgetfulStorage)
+    for record in sorted(snapshot["records"], key=lambda r: r["age"], reverse=True):
+        value = base64.b64decode(record["bytes"]) if "bytes" in record else record["value"]
+        key = bytes.fromhex(record["key"])
+        if forgetful:
+            if record["age"] < dht_node.storage.ttl:
+                dht_node.storage.data[key] = (now - record["age"], value)
+        else:
+            dht_node.storage[key] = value
+
+async def _snapshot_dht_periodically(dht_node: "KademliaServer", path: str, interval: float):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            _save_dht_snapshot(dht_node, path)
+        except OSError as e:
+            print(f"[DHT] WARN: Failed to write snapshot {path}: {e}")
+
+# --- LAN Discovery (UDP multicast) ---
+# Datagrams are _LAN_MAGIC + kind + body. An announce body is the record length
+# (uint16) + the compact record (see _encode_record) + the owner's signature over
+# everything before it; a query body is the wanted DID. The DID of an announced
+# record is recomputed from its public key and the signature checked against that
+# key, so only the key holder can announce (or bump the seq of) a DID.
+
+_LAN_GROUP = "239.255.42.99"
+_LAN_PORT = 48999
+_LAN_MAGIC = b"AWL2"  # AWL1 announcements were unsigned
+_LAN_ANNOUNCE = b"A"
+_LAN_QUERY = b"Q"
+_LAN_RECORD_LEN = struct.Struct(">H")
+
+def _did_from_pem(public_key_pem: str) -> str:
+    # Our identifier is the sha256 hash of the PEM
+    digest = hashlib.sha256(public_key_pem.encode('utf-8')).hexdigest()
+    return f"did:agentweb:{digest}"
+
+def _verify_signature(message: bytes, signature: bytes, public_key_pem: str) -> bool:
+    """RSA-PSS/SHA-256 check, as used for every signed payload, record and heartbeat."""
+    try:
+        public_key = serialization.load_pem_public_key(public_key_pem.encode('utf-8'))
+        public_key.verify(
+            signature,
+            message,
+            padding.PSS(mgf=padding.MGF1(hashes.SHA256()), salt_length=padding.PSS.MAX_LENGTH),
+            hashes.SHA256()
+        )
+        return True
+    except InvalidSignature:
+        return False
+
+class _LanDiscovery(asyncio.DatagramProtocol):
+    """Multicast announce/query with a table of neighbours' self-certifying records."""
+
+    def __init__(self, owner_did: str, sign: Callable[[bytes], bytes], group: str, port: int,
+                 interface: str, announce_interval: float):
+        self.owner_did = owner_did
+        self.sign = sign
+        self.group = group
+        self.port = port
+        self.interface = interface
+        self.announce_interval = announce_interval
+        self.record: Optional[AgentRecord] = None  # What we announce; set by Agent.register
+        self._announcement: Optional[bytes] = None  # Signed datagram for `record`
+        self.table = _TTLCache(max_entries=4096)  # did -> AgentRecord
+        self.transport: Optional[asyncio.DatagramTransport] = None
+        self._waiters: Dict[str, List[asyncio.Future]] = {}
+        self._announcer: Optional[asyncio.Task] = None
+
+    async def start(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        # Every agent on the host binds the same port; each gets a copy of group traffic
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if hasattr(socket, "SO_REUSEPORT"):
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        sock.bind(("", self.port))
+        interface = socket.inet_aton(self.interface)
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, socket.inet_aton(self.group) + interface)
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF, interface)
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 1)  # Never routed off the segment
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)  # Same-host agents hear us
+        sock.setblocking(False)
+        self.transport, _ = await asyncio.get_running_loop().create_datagram_endpoint(lambda: self, sock=sock)
+        self._announcer = asyncio.create_task(self._announce_periodically())
+
+    def close(self):
+        if self._announcer:
+            self._announcer.cancel()
+        if self.transport:
+            self.transport.close()
+            self.transport = None
+
+    def set_record(self, record: AgentRecord):
+        self.record = record
+        encoded = _encode_record(record)
+        signed = _LAN_MAGIC + _LAN_ANNOUNCE + _LAN_RECORD_LEN.pack(len(encoded)) + encoded
+        self._announcement = signed + self.sign(signed)
+        self.announce()
+
+    def announce(self):
+        if self._announcement is not None and self.transport is not None:
+            self.transport.sendto(self._announcement, (self.group, self.port))
+
+    async def _announce_periodically(self):
+        while True:
+            await asyncio.sleep(self.announce_interval)
+            self.announce()
+
+    async def lookup(self, did: str, timeout: float) -> Optional[AgentRecord]:
+        """Returns a neighbour's record from the table, or multicasts a query and waits briefly."""
+        record = self.table.get(did)
+        if record is not None or self.transport is None:
+            return record
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(did, []).append(waiter)
+        try:
+            self.transport.sendto(_LAN_MAGIC + _LAN_QUERY + did.encode('utf-8'), (self.group, self.port))
+            return await asyncio.wait_for(waiter, timeout)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            waiters = self._waiters.get(did, [])
+            if waiter in waiters:
+                waiters.remove(waiter)
+            if not waiters:
+                self._waiters.pop(did, None)
+
+    def datagram_received(self, data: bytes, addr):
+        if not data.startswith(_LAN_MAGIC):
+            return
+        kind, body = data[4:5], data[5:]
+        if kind == _LAN_QUERY:
+            if body.decode('utf-8', 'replace') == self.owner_did:
+                self.announce()
+        elif kind == _LAN_ANNOUNCE:
+            try:
+                length, = _LAN_RECORD_LEN.unpack_from(body)
+                end = _LAN_RECORD_LEN.size + length
+                record = _decode_record(body[_LAN_RECORD_LEN.size:end])
+                if not _verify_signature(data[:5 + end], body[end:], record.public_key_pem):
+                    return
+            except Exception:
+                return
+            did = _did_from_pem(record.public_key_pem)
+            if did == self.owner_did:
+                return
+            known = self.table.get(did, count_miss=False)
+            if known is not None and known.seq > record.seq:
+                return  # Reordered or replayed older announcement
+            self.table.put(did, record, self.announce_interval * 3)
+            for waiter in self._waiters.pop(did, []):
+                if not waiter.done():
+                    waiter.set_result(record)
+
+# --- In-Process Agent Directory ---
+# DID -> live Agent for every agent whose listener runs in this process.
+# send() uses it to hand messages straight to a co-located handler,
+# skipping signing, HTTP and signature verification.
+_LOCAL_AGENTS: "weakref.WeakValueDictionary[str, Agent]" = weakref.WeakValueDictionary()
+
+def get_local_agent(did: str) -> Optional["Agent"]:
+    """Returns the agent hosted in this process under `did`, if any."""
+    return _LOCAL_AGENTS.get(did)
+
+# --- Persistent Peer Channels ---
+
+class _FrameNotSent(Exception):
+    """The request frame never left this side, so the peer can't have run it."""
+
+class _PeerChannel:
+    """
+    A long-lived, authenticated WebSocket to one peer DID.
+    Requests are multiplexed by id; responses come back on the same socket.
+    """
+
+    def __init__(self, peer_did: str, websocket):
+        self.peer_did = peer_did
+        self.websocket = websocket
+        self.last_used = time.monotonic()
+        self._next_id = 0
+        self._pending: Dict[int, asyncio.Future] = {}
+        self._reader = asyncio.create_task(self._read_loop())
+
+    @property
+    def is_open(self) -> bool:
+        return not self._reader.done()
+
+    @property
+    def idle(self) -> bool:
+        return not self._pending
+
+    async def request(self, body: Dict[str, Any], timeout: float,
+                      idempotency_key: Optional[str] = None,
+                      deadline: Optional[float] = None,
+                      capability: Optional[str] = None) -> Dict[str, Any]:
+        self._next_id += 1
+        request_id = self._next_id
+        future = asyncio.get_running_loop().create_future()
+        self._pending[request_id] = future
+        self.last_used = time.monotonic()
+        try:
+            frame = {"id": request_id, "body": body}
+            if idempotency_key:
+                frame["idempotency_key"] = idempotency_key
+            if deadline is not None:
+                frame["deadline"] = deadline
+            if capability:
+                frame["capability"] = capability
+            try:
+                await self.websocket.send(json.dumps(frame))
+            except Exception as e:
+                raise _FrameNotSent(str(e)) from e
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            self._pending.pop(request_id, None)
+            self.last_used = time.monotonic()
+
+    async def _read_loop(self):
+        error: Exception = ConnectionError(f"Channel to {self.peer_did} closed")
+        try:
+            async for raw in self.websocket:
+                frame = json.loads(raw)
+                future = self._pending.get(frame.get("id"))
+                if future is None or future.done():
+                    continue
+                if "error" in frame:
+                    future.set_result(self._error_result(frame))
+                else:
+                    future.set_result(frame.get("result"))
+        except Exception as e:
+            error = e
+        finally:
+            for future in self._pending.values():
+                if not future.done():
+                    future.set_exception(error)
+
+    @staticmethod
+    def _error_result(frame: Dict[str, Any]) -> Dict[str, Any]:
+        """Maps an error frame to what send() returns for the same HTTP status."""
+        code = frame.get("code")
+        if code == 504:
+            return {"error": "Deadline exceeded"}
+        if code == 503:
+            return {"error": f"Target is overloaded: {frame['error']}"}
+        if code == 429:
+            return {"error": "Rate limit exceeded", "retry_after": float(frame.get("retry_after", 1))}
+        return {"error": f"Remote handler failed: {frame['error']}"}
+
+    async def close(self):
+        self._reader.cancel()
+        try:
+            await self.websocket.close()
+        except Exception:
+            pass
+
+# --- Durable Outbox ---
+#
+# send_later() appends to a SQLite table and returns; Agent._run_outbox delivers
+# due rows in per-peer batches to /invoke_batch, deleting them once the peer
+# answers. Each row's ID is its idempotency key, so redelivery after a crash or
+# a lost response replays the peer's stored response instead of re-running it.
+
+_OUTBOX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id TEXT PRIMARY KEY,
+    target_did TEXT NOT NULL,
+    body TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    next_attempt REAL NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT,
+    dead INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS outbox_due ON outbox (dead, next_attempt);
+CREATE INDEX IF NOT EXISTS outbox_target ON outbox (target_did, dead);
+"""
+
+class _Outbox:
+    """SQLite-backed queue of messages awaiting delivery, one row per message."""
+
+    def __init__(self, path: str, max_batch: int, max_attempts: int,
+                 base_delay: float, max_delay: float, concurrency: int):
+        import sqlite3  # Only agents that enable the outbox pay for it
+
+        self.path = path
+        self.max_batch = max_batch
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.concurrency = concurrency  # Peers being delivered to at once
+        self.db = sqlite3.connect(path, isolation_level=None)
+        # WAL + NORMAL: commits survive a process crash without an fsync per message
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(_OUTBOX_SCHEMA)
+
+    def add(self, message_id: str, target_did: str, body: Dict[str, Any]) -> bool:
+        """Queues a message; False if `message_id` is already queued."""
+        now = time.time()
+        cursor = self.db.execute(
+            "INSERT OR IGNORE INTO outbox (id, target_did, body, created_at, next_attempt) VALUES (?, ?, ?, ?, ?)",
+            (message_id, target_did, json.dumps(body, default=str), now, now))
+        return cursor.rowcount == 1
+
+    def due(self, now: float, busy: List[str], limit: int = 1024) -> Dict[str, List[tuple]]:
+        """Due (id, body, attempts) rows grouped by target, at most max_batch per target, skipping `busy`."""
+        skip = ",".join("?" * len(busy))
+        rows = self.db.execute(
+            f"SELECT id, target_did, body, attempts FROM outbox WHERE dead = 0 AND next_attempt <= ? "
+            f"AND target_did NOT IN ({skip}) ORDER BY next_attempt LIMIT ?", (now, *busy, limit))
+        batches: Dict[str, List[tuple]] = {}
+        for message_id, target_did, body, attempts in rows:
+            batch = batches.setdefault(target_did, [])
+            if len(batch) < self.max_batch:
+                batch.append((message_id, json.loads(body), attempts))
+        return batches
+
+    def next_due(self, busy: List[str]) -> Optional[float]:
+        skip = ",".join("?" * len(busy))
+        row = self.db.execute(f"SELECT MIN(next_attempt) FROM outbox WHERE dead = 0 "
+                              f"AND target_did NOT IN ({skip})", busy).fetchone()
+        return row[0]
+
+    def delivered(self, message_ids: List[str]):
+        self.db.executemany("DELETE FROM outbox WHERE id = ?", [(i,) for i in message_ids])
+
+    def failed(self, target_did: str, rows: List[tuple], error: str, peer_down: bool) -> List[str]:
+        """
+        Reschedules failed rows with exponential backoff and jitter; returns the
+        IDs that ran out of attempts. With `peer_down`, the target's other queued
+        rows wait out the same backoff instead of failing one batch at a time.
+        """
+        now = time.time()
+        dead, delays = [], []
+        self.db.execute("BEGIN")
+        for message_id, _, attempts in rows:
+            attempts += 1
+            if attempts >= self.max_attempts:
+                dead.append(message_id)
+                self.db.execute("UPDATE outbox SET attempts = ?, last_error = ?, dead = 1 WHERE id = ?",
+                                (attempts, error, message_id))
+                continue
+            delay = min(self.max_delay, self.base_delay * 2 ** min(attempts, 30)) * random.uniform(0.5, 1.0)
+            delays.append(delay)
+            self.db.execute("UPDATE outbox SET attempts = ?, last_error = ?, next_attempt = ? WHERE id = ?",
+                            (attempts, error, now + delay, message_id))
+        if peer_down and delays:
+            self.db.execute("UPDATE outbox SET next_attempt = ? WHERE target_did = ? AND dead = 0 "
+                            "AND next_attempt < ?", (now + min(delays), target_did, now + min(delays)))
+        self.db.execute("COMMIT")
+        return dead
+
+    def stats(self) -> Dict[str, int]:
+        counts = dict(self.db.execute("SELECT dead, COUNT(*) FROM outbox GROUP BY dead").fetchall())
+        return {"pending": counts.get(0, 0), "dead": counts.get(1, 0)}
+
+    def dead_letters(self, limit: int = 100) -> List[Dict[str, Any]]:
+        rows = self.db.execute("SELECT id, target_did, body, attempts, last_error FROM outbox "
+                               "WHERE dead = 1 ORDER BY created_at LIMIT ?", (limit,))
+        return [{"id": i, "target_did": t, "body": json.loads(b), "attempts": a, "last_error": e}
+                for i, t, b, a, e in rows]
+
+    def close(self):
+        self.db.close()
+
+# --- Handler Routes ---
+#
+# Agent.route() registers a handler per capability (Payload.capability, set by
+# execute_task) or per body["action"]. Each route has its own concurrency limit,
+# bounded wait queue, timeout and latency histogram, so a slow route can only
+# exhaust its own slots. on_message() is the "default" route, without limits.
+
+_LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class RouteOverloaded(Exception):
+    """Raised when a route's concurrency slots and wait queue are all taken (HTTP 503)."""
+
+class NoRouteError(Exception):
+    """Raised when no route() or on_message() handler matches a message (HTTP 404)."""
+
+class _LatencyHistogram:
+    """Fixed-bucket latency histogram (seconds), exported in Prometheus format by /metrics."""
+
+    def __init__(self, buckets: tuple = _LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # Last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+        self.max = 0.0
+
+    def observe(self, seconds: float):
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+        self.max = max(self.max, seconds)
+
+    def quantile(self, q: float) -> float:
+        """Estimated q-quantile, interpolated linearly within its bucket (never above the max seen)."""
+        if not self.count:
+            return 0.0
+        rank, seen = q * self.count, 0
+        for i, n in enumerate(self.counts):
+            if n and seen + n >= rank:
+                lower = self.buckets[i - 1] if i else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.max
+                return min(self.max, lower + (upper - lower) * (rank - seen) / n)
+            seen += n
+        return self.max
+
+class _Route:
+    """A handler with its own concurrency limit, wait queue, timeout and statistics."""
+
+    def __init__(self, name: str, handler: Callable, concurrency: Optional[int] = None,
+                 queue_size: int = 100, timeout: Optional[float] = None):
+        self.name = name
+        self.handler = handler
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.in_flight = 0
+        self.queued = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.errors = 0
+        self.latency = _LatencyHistogram()
+        self._slots = asyncio.Semaphore(concurrency) if concurrency else None
+
+    async def acquire(self, deadline: Optional[float]):
+        """Takes a slot, waiting in the route's queue until `deadline` if all are busy."""
+        if self._slots is not None:
+            if self._slots.locked():
+                if self.queued >= self.queue_size:
+                    self.rejected += 1
+                    raise RouteOverloaded(f"Route '{self.name}' is at capacity")
+                self.queued += 1
+                try:
+                    remaining = None if deadline is None else deadline - time.time()
+                    await asyncio.wait_for(self._slots.acquire(), remaining)
+                except asyncio.TimeoutError:
+                    self.timeouts += 1
+                    raise DeadlineExceeded(f"Deadline exceeded while queued for route '{self.name}'")
+                finally:
+                    self.queued -= 1
+            else:
+                await self._slots.acquire()
+        self.in_flight += 1
+
+    def release(self, elapsed: float):
+        self.in_flight -= 1
+        if self._slots is not None:
+            self._slots.release()
+        self.latency.observe(elapsed)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"in_flight": self.in_flight, "queued": self.queued, "concurrency": self.concurrency,
+                "completed": self.latency.count, "rejected": self.rejected, "timeouts": self.timeouts,
+                "errors": self.errors, "p50_ms": round(self.latency.quantile(0.5) * 1000.0, 3),
+                "p95_ms": round(self.latency.quantile(0.95) * 1000.0, 3),
+                "p99_ms": round(self.latency.quantile(0.99) * 1000.0, 3)}
+
+# --- Rate Limiting ---
+#
+# Token buckets per sender DID and per listener, for the whole agent ("*") and
+# optionally per capability/action (the same names as route()). admit() runs on
+# the decoded but not yet verified payload: it only peeks at the claimed sender's
+# bucket, so forged messages can't drain someone else's budget, and takes from
+# the global bucket, which protects the CPU that verification would burn.
+# charge() takes from the sender's bucket once the signature checks out.
+
+class _TokenBucket:
+    """Refills at `rate` tokens/s up to `burst`; may go into debt for multi-token costs."""
+
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def wait_time(self, now: float) -> float:
+        """Seconds until a token is available (0 if one is)."""
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self, now: float, cost: float = 1) -> float:
+        wait = self.wait_time(now)
+        if not wait:
+            self.tokens -= cost
+        return wait
+
+class _RateLimiter:
+    """Per-scope global buckets plus LRU-bounded per-(scope, sender) buckets."""
+
+    def __init__(self, max_senders: int = 10000):
+        self.max_senders = max_senders
+        self.limits: Dict[str, tuple] = {}  # scope -> ((rate, burst) per sender | None, (rate, burst) global | None)
+        self.rejected = 0
+        self._global: Dict[str, _TokenBucket] = {}
+        self._senders: "OrderedDict[tuple, _TokenBucket]" = OrderedDict()
+
+    def configure(self, scope: str, sender: Optional[tuple], global_: Optional[tuple]):
+        self.limits[scope] = (sender, global_)
+        if global_:
+            self._global[scope] = _TokenBucket(*global_)
+        else:
+            self._global.pop(scope, None)
+        for key in [k for k in self._senders if k[0] == scope]:
+            del self._senders[key]
+
+    def scopes(self, body: Any, capability: Optional[str], route_field: str) -> List[str]:
+        """The limit scopes a message counts against: "*" and its capability/action, if limited."""
+        if not self.limits:
+            return []
+        scopes = ["*"] if "*" in self.limits else []
+        name = capability if capability in self.limits else None
+        if name is None and isinstance(body, dict) and body.get(route_field) in self.limits:
+            name = body[route_field]
+        if name and name != "*":
+            scopes.append(name)
+        return scopes
+
+    def admit(self, sender_did: str, scopes: List[str], cost: float = 1) -> float:
+        """Pre-verification check; returns seconds to wait (0 = go ahead and verify)."""
+        now = time.monotonic()
+        for scope in scopes:
+            bucket = self._senders.get((scope, sender_did))
+            wait = bucket.wait_time(now) if bucket is not None else 0.0
+            if not wait and scope in self._global:
+                wait = self._global[scope].take(now, cost)
+            if wait:
+                self.rejected += 1
+                return wait
+        return 0.0
+
+    def charge(self, sender_did: str, scopes: List[str], cost: float = 1) -> float:
+        """Takes from the (now verified) sender's buckets; returns seconds to wait if over the limit."""
+        now = time.monotonic()
+        for scope in scopes:
+            limit = self.limits[scope][0]
+            if not limit:
+                continue
+            key = (scope, sender_did)
+            bucket = self._senders.get(key)
+            if bucket is None:
+                bucket = self._senders[key] = _TokenBucket(*limit)
+                # Least recently seen senders go first; they have most likely refilled anyway
+                while len(self._senders) > self.max_senders:
+                    self._senders.popitem(last=False)
+            else:
+                self._senders.move_to_end(key)
+            wait = bucket.take(now, cost)
+            if wait:
+                self.rejected += 1
+                return wait
+        return 0.0
+
+    def stats(self) -> Dict[str, int]:
+        return {"tracked_senders": len(self._senders), "rejected": self.rejected}
 
 # --- The Main Agent Class (v4 - DID Enabled) ---
 
 class Agent:
     def __init__(self, registry_url: str, key_file: str,
-                 default_policy: Dict[str, float] = None, demo_mode: bool = False):
+                 default_policy: Dict[str, float] = None, demo_mode: bool = False,
+                 local_transport: bool = True, use_channels: bool = False,
+                 channel_idle_timeout: float = 60.0,
+                 http_client: Optional[httpx.AsyncClient] = None,
+                 discovery_ttl: float = 30.0,
+                 snapshot_path: Optional[str] = None):
         # 'agent_id' is GONE.
         self.registry_url = registry_url
         self.key_file = key_file
         self.demo_mode = demo_mode  # SPRINT 9: Enable hybrid demo mode
+        self.local_transport = local_transport  # Short-circuit sends to co-located agents
+        self.use_channels = use_channels  # Reuse one WebSocket per peer instead of a POST per message
+        self.channel_idle_timeout = channel_idle_timeout
         self.private_key, self.public_key = self._load_or_create_keys()
         self.public_key_pem = self.public_key.public_bytes(
             encoding=serialization.Encoding.PEM,
@@ -71,9 +1155,75 @@ class Agent:
             self.default_policy = default_policy
 
         self._message_handler: Callable = None
-
-        self.dht_node: Optional[KademliaServer] = None
-        self.http_client = httpx.AsyncClient()
+        self._routes: Dict[str, _Route] = {}  # Capability/action -> route (see route())
+        self._default_route: Optional[_Route] = None  # Wraps _message_handler
+        self.route_field = "action"  # Body field that selects a route when no capability matches
+        self._rate_limiter = _RateLimiter()  # No limits until rate_limit() is called
+
+        self.dht_node: Optional["KademliaServer"] = None
+        self.dht_state_file: Optional[str] = None
+        self._dht_snapshot_task: Optional[asyncio.Task] = None
+        self.dht_lookup_timeout = 10.0  # Overall deadline for one DHT lookup
+        self.dht_hedge = 3  # Direct FIND_VALUEs raced against each iterative lookup
+        self.republish_interval = 3600.0  # Re-store our record before peers expire or churn away
+        self.capability_index_ttl = 7200.0  # Lifetime of our capability index entries
+        self.registry_search = True  # Ask the registry's /search before the DHT index
+        self.registry_search_hedge = 0.25  # Seconds the registry gets before the DHT index is read too
+        self.capability_search_ttl = 10.0  # Non-empty DHT index reads are reused this long
+        self._capability_search_cache = _TTLCache(max_entries=1024)
+        self._published_capabilities: List[str] = []
+        self._lan: Optional[_LanDiscovery] = None  # Set by start_lan_discovery
+        self.lan_lookup_timeout = 0.25
+        # Host-local registry snapshot kept fresh by a sidecar (see registry_snapshot.py)
+        self.registry_snapshot = None
+        if snapshot_path:
+            from registry_snapshot import RegistrySnapshot
+            self.registry_snapshot = RegistrySnapshot(snapshot_path)
+        self._published_record: Optional[AgentRecord] = None
+        self._republish_task: Optional[asyncio.Task] = None
+        # Pass a shared client to pool connections across many agents in one process
+        self.http_client = http_client or httpx.AsyncClient()
+        self.uds_path: Optional[str] = None  # Set by listen_and_join when a Unix socket is bound
+        self._uds_clients: Dict[str, httpx.AsyncClient] = {}
+        self._http_server = None  # uvicorn.Server while listen_and_join is running
+        self._listening = False
+        self.ready = asyncio.Event()  # Set once the DHT node and HTTP listener are up
+        self._channels: Dict[str, _PeerChannel] = {}
+        self._channel_locks: Dict[str, asyncio.Lock] = {}
+        self._channel_sweeper: Optional[asyncio.Task] = None
+        # Caller-side response caches, one per (max_entries, max_bytes) of the CachePolicy
+        # using it, so call sites with different limits don't evict each other's entries
+        self._response_caches: Dict[tuple, _TTLCache] = {}
+        # Verified records by DID, so repeat senders/targets skip the DHT/registry round trip
+        self.discovery_ttl = discovery_ttl
+        # Versioned records past discovery_ttl are revalidated against their DHT
+        # version key; a full refetch is forced once they are this old
+        self.discovery_max_age = 300.0
+        self._discovery_cache = _TTLCache(max_entries=4096)
+        # Listener-side replay cache: (sender DID, idempotency key) -> stored response
+        self.idempotency_ttl = 600.0
+        self._idempotency_cache = _TTLCache(max_entries=10000, max_bytes=16 * 1024 * 1024)
+        self._idempotent_in_flight: Dict[tuple, asyncio.Future] = {}
+        # Async tasks: submitter-side futures by task ID (with the provider's DID), and
+        # provider-side running jobs plus finished outcomes kept for polling
+        self.task_poll_interval = 1.0
+        self.task_result_ttl = 3600.0
+        self._pending_tasks: Dict[str, tuple] = {}
+        # Pushed outcomes nobody has waited for yet, dropped after task_result_ttl
+        self._received_tasks = _TTLCache(max_entries=10000, max_bytes=64 * 1024 * 1024)
+        self._running_tasks: Dict[str, tuple] = {}  # task ID -> (sender DID, asyncio.Task)
+        self._task_results = _TTLCache(max_entries=10000, max_bytes=64 * 1024 * 1024)
+        self._outbox: Optional[_Outbox] = None  # Set by start_outbox()
+        self._outbox_task: Optional[asyncio.Task] = None
+        self._outbox_workers: Dict[str, asyncio.Task] = {}  # Target DID -> batch being delivered
+        self._outbox_wakeup = asyncio.Event()
+        self._outbox_on_result: Optional[Callable] = None
+        self._heartbeat_task: Optional[asyncio.Task] = None  # Set by start_heartbeat()
+        self._background_tasks: set = set()  # Fire-and-forget work (reports), kept referenced until done
+        self._load_baseline: Dict[str, tuple] = {}  # Route name -> (route, bucket counts at last report)
+        self._dispatched: Dict[str, int] = {}  # execute_task() sends still in flight, by DID
+        self.cacheable = False  # What this agent advertised in register()
+        self.cache_ttl = 0.0
 
     # --- 1. Key & DID Management ---
 
@@ -100,16 +1250,12 @@ class Agent:
         """Creates a verifiable DID from the agent's public key."""
         # did:method:method-specific-identifier
         # Our method is 'agentweb'
-        # Our identifier is the sha256 hash of the PEM
-        digest = hashlib.sha256(self.public_key_pem.encode('utf-8')).hexdigest()
-        return f"did:agentweb:{digest}"
+        return _did_from_pem(self.public_key_pem)
 
     def _verify_did(self, did: str, public_key_pem: str) -> bool:
         """Verifies that a DID correctly matches a public key."""
         try:
-            digest = hashlib.sha256(public_key_pem.encode('utf-8')).hexdigest()
-            expected_did = f"did:agentweb:{digest}"
-            return did == expected_did
+            return did == _did_from_pem(public_key_pem)
         except Exception:
             return False
 
@@ -123,128 +1269,561 @@ class Agent:
         )
 
     def _verify(self, message: bytes, signature: bytes, public_key_pem: str) -> bool:
-        try:
-            public_key = serialization.load_pem_public_key(public_key_pem.encode('utf-8'))
-            public_key.verify(
-                signature,
-                message,
-                padding.PSS(mgf=padding.MGF1(hashes.SHA256()), salt_length=padding.PSS.MAX_LENGTH),
-                hashes.SHA256()
-            )
-            return True
-        except InvalidSignature:
-            return False
+        return _verify_signature(message, signature, public_key_pem)
+
+    def _sign_payload(self, message_body: Dict[str, Any], **fields) -> Dict[str, str]:
+        """Wraps a message body (plus optional Payload fields) in a signed, base64-encoded envelope."""
+        payload_data = {
+            "sender_did": self.did,
+            "body": message_body,
+            "timestamp": time.time()
+        }
+        payload_data.update({k: v for k, v in fields.items() if v is not None})
+        payload_json = json.dumps(payload_data, sort_keys=True)
+        payload_b64 = base64.b64encode(payload_json.encode('utf-8')).decode('utf-8')
+
+        signature = self._sign(payload_json.encode('utf-8'))
+        signature_b64 = base64.b64encode(signature).decode('utf-8')
+
+        return { "payload": payload_b64, "signature": signature_b64 }
 
     # --- 3. DHT Methods ---
 
-    async def start_dht_node(self, host: str, port: int, bootstrap_node: Optional[tuple] = None):
-        """Initializes and runs the Kademlia DHT node."""
-        self.dht_node = KademliaServer()
-        await self.dht_node.listen(port, interface=host)
+    async def start_dht_node(self, host: str, port: int, bootstrap_node: Optional[tuple] = None,
+                             state_file: Optional[str] = None, snapshot_interval: float = 300.0,
+                             ksize: int = 20, alpha: int = 3, rpc_timeout: float = 5.0,
+                             lookup_timeout: float = 10.0, hedge: int = 3):
+        """
+        Initializes and runs the Kademlia DHT node.
 
-        if bootstrap_node:
-            # Join the existing network
-            await self.dht_node.bootstrap([(bootstrap_node[0], bootstrap_node[1])])
-            print(f"[DHT] Node {self.did} bootstrapped to {bootstrap_node}")
+        With `state_file`, routing-table contacts and stored records are saved
+        every `snapshot_interval` seconds and on stop_dht_node(), and restored
+        on the next start.
+
+        `ksize`, `alpha` and `rpc_timeout` tune the Kademlia node. Each
+        fetch_record() gives up after `lookup_timeout` seconds and races `hedge`
+        direct queries to the closest known peers against the iterative lookup.
+        """
+        self.dht_node = await _start_kademlia_node(host, port, bootstrap_node, label=self.did,
+                                                   state_file=state_file, ksize=ksize,
+                                                   alpha=alpha, rpc_timeout=rpc_timeout)
+        self.dht_state_file = state_file
+        self.dht_lookup_timeout = lookup_timeout
+        self.dht_hedge = hedge
+        if state_file:
+            self._dht_snapshot_task = asyncio.create_task(
+                _snapshot_dht_periodically(self.dht_node, state_file, snapshot_interval))
+
+    def stop_dht_node(self):
+        """Stops the DHT node, writing a final snapshot if a state file is configured."""
+        if self.dht_node is None:
+            return
+        if self._republish_task:
+            self._republish_task.cancel()
+            self._republish_task = None
+        if self._dht_snapshot_task:
+            self._dht_snapshot_task.cancel()
+            self._dht_snapshot_task = None
+        if self.dht_state_file:
+            _save_dht_snapshot(self.dht_node, self.dht_state_file)
+            print(f"[DHT] Saved snapshot to {self.dht_state_file}")
+        self.dht_node.stop()
+        self.dht_node = None
+
+    async def publish_record(self, agent_record: AgentRecord) -> bool:
+        """
+        Publishes this agent's full record to the DHT under its DID, plus its
+        `seq` under a small version key so caches can revalidate cheaply.
+        """
+        # Publish to DHT using our DID as the key
+        stored, _ = await asyncio.gather(
+            self.dht_node.set(self.did, _encode_record(agent_record)),
+            self.dht_node.set(_version_key(self.did), agent_record.seq)
+        )
+        if stored:
+            self._published_record = agent_record
+            print(f"[DHT] Published record for {self.did} to the network.")
         else:
-            print(f"[DHT] Node {self.did} started as bootstrap node")
+            print(f"[DHT] WARN: No DHT peer accepted the record for {self.did}.")
+        return stored
+
+    def _next_seq(self) -> int:
+        """Millisecond timestamp, bumped if needed so versions never go backwards."""
+        previous = self._published_record.seq if self._published_record else 0
+        return max(previous + 1, int(time.time() * 1000))
+
+    async def _republish_periodically(self):
+        """Re-stores the last published record so it outlives kademlia expiry and node churn."""
+        while True:
+            await asyncio.sleep(self.republish_interval)
+            if self.dht_node is None or self._published_record is None:
+                continue
+            try:
+                await self.publish_record(self._published_record)
+                if self._published_capabilities:
+                    await self.publish_capabilities(self._published_capabilities)
+            except Exception as e:
+                print(f"[DHT] WARN: Republish failed: {e}")
 
-        print(f"[DHT] Node {self.did} listening on {host}:{port}")
+    def _start_republishing(self):
+        if self._republish_task is None or self._republish_task.done():
+            self._republish_task = asyncio.create_task(self._republish_periodically())
 
-    async def publish_record(self, agent_record: AgentRecord):
-        """Publishes this agent's full record to the DHT under its DID."""
-        record_json = agent_record.model_dump_json()
-        # Publish to DHT using our DID as the key
-        await self.dht_node.set(self.did, record_json)
-        print(f"[DHT] Published record for {self.did} to the network.")
+    async def fetch_record_version(self, did: str) -> Optional[int]:
+        """
+        Fetches only the `seq` published for `did` (a few bytes instead of the record).
+        The version key is unsigned, so treat it as a freshness hint: a mismatch
+        means refetch, a match only extends a cached record up to discovery_max_age.
+        """
+        if self.dht_node is None:
+            return None
+        version = await self._dht_get(_version_key(did))
+        return version if isinstance(version, int) else None
+
+    async def _dht_get(self, key: str):
+        """dht_node.get() bounded by dht_lookup_timeout; None on timeout or error."""
+        # asyncio.wait rather than wait_for: a timed-out lookup must finish, not be
+        # cancelled (see _hedged_lookup)
+        lookup = asyncio.ensure_future(self.dht_node.get(key))
+        lookup.add_done_callback(_discard_result)
+        done, _ = await asyncio.wait([lookup], timeout=self.dht_lookup_timeout)
+        if not done or lookup.exception():
+            return None
+        return lookup.result()
+
+    async def publish_capabilities(self, capabilities: List[str]) -> bool:
+        """Adds (or refreshes) this agent in the DHT capability index for each capability."""
+        shard = _cap_index_shard(self.did)
+        expires = int(time.time() + self.capability_index_ttl)
+
+        stored = await asyncio.gather(*(self._add_cap_entries(_cap_index_key(capability, shard),
+                                                              {self.did: expires})
+                                        for capability in capabilities))
+        if all(stored):
+            self._published_capabilities = list(capabilities)
+            print(f"[DHT] Indexed {self.did} under {len(capabilities)} capabilities.")
+        else:
+            print(f"[DHT] WARN: No DHT peer accepted the capability index for {self.did}.")
+        return all(stored)
+
+    async def _add_cap_entries(self, key: str, additions: Dict[str, int]) -> bool:
+        """Merges DID -> expiry entries into one capability index shard."""
+        # Read-modify-write: concurrent writers may drop each other's entry, which
+        # the next republish restores
+        entries = _unpack_cap_entries(await self._dht_get(key), time.time())
+        entries.update(additions)
+        return await self.dht_node.set(key, _pack_cap_entries(entries))
+
+    async def search_dht(self, capability: str) -> List[str]:
+        """
+        Reads every shard of the capability index; DIDs that expire last come first.
+        Non-empty results are reused for `capability_search_ttl` seconds.
+        """
+        if self.dht_node is None:
+            return []
+        cached = self._capability_search_cache.get(capability)
+        if cached is not None:
+            return list(cached)
+        shards = await asyncio.gather(*(self._dht_get(_cap_index_key(capability, shard))
+                                        for shard in range(_CAP_INDEX_SHARDS)))
+        now = time.time()
+        entries = {}
+        for raw in shards:
+            entries.update(_unpack_cap_entries(raw, now))
+        did_list = sorted(entries, key=entries.get, reverse=True)
+        if did_list:
+            self._capability_search_cache.put(capability, did_list, self.capability_search_ttl)
+        return list(did_list)
+
+    async def _search_registry(self, capability: str) -> List[str]:
+        try:
+            r = await self.http_client.get(f"{self.registry_url}/search", params={"capability": capability})
+            r.raise_for_status()
+            return r.json()  # List[str] of DIDs
+        except (httpx.HTTPError, json.JSONDecodeError) as e:
+            print(f"[SDK] WARN: Registry search for '{capability}' failed: {e}")
+            return []
+
+    async def _fetch_reputations(self, did_list: List[str]) -> Dict[str, ReputationStats]:
+        """
+        Reputations from the Indexer, each with the candidate's latest load if it
+        sent a recent heartbeat; neutral defaults if the Indexer can't be reached.
+        """
+        reputations = {did: ReputationStats() for did in did_list}
+        try:
+            r = await self.http_client.post(f"{self.registry_url}/get_reputations",
+                                            json={"agent_ids": did_list})
+            r.raise_for_status()
+            data = r.json()
+            for did, stats_dict in data['reputations'].items():
+                reputations[did] = ReputationStats(**stats_dict)
+            for did, load in data.get('loads', {}).items():
+                if did in reputations:
+                    reputations[did].load = AgentLoad(**load)
+        except (httpx.HTTPError, json.JSONDecodeError, KeyError) as e:
+            print(f"[SDK] WARN: Reputation lookup failed, ranking with default reputations: {e}")
+        return reputations
+
+    async def _search_capability(self, capability: str) -> List[str]:
+        """
+        Finds DIDs for a capability in the DHT index. If `registry_search` is on
+        (or there's no DHT node) the registry is asked first; the DHT index (8
+        shard lookups) is only read if the registry hasn't answered within
+        `registry_search_hedge` seconds or came back empty. Then the first
+        non-empty answer wins.
+        """
+        searches = []
+        try:
+            if self.registry_search or self.dht_node is None:
+                registry = asyncio.ensure_future(self._search_registry(capability))
+                searches.append(registry)
+                if self.dht_node is not None:
+                    await asyncio.wait([registry], timeout=self.registry_search_hedge)
+                    if registry.done() and registry.result():
+                        return registry.result()
+            if self.dht_node is not None:
+                searches.append(asyncio.ensure_future(self.search_dht(capability)))
+            for next_done in asyncio.as_completed(searches):
+                did_list = await next_done
+                if did_list:
+                    return did_list
+            # Offline fallback: whatever the host's last registry snapshot knew
+            return self.registry_snapshot.search(capability) if self.registry_snapshot else []
+        finally:
+            for search in searches:
+                search.add_done_callback(_discard_result)
 
     async def fetch_record(self, did: str) -> Optional[AgentRecord]:
         """Fetches and *verifies* an agent's record from the DHT."""
-        record_json = await self.dht_node.get(did)
-        if not record_json:
-            print(f"[SDK] DHT lookup FAILED for {did}")
+        if self.dht_node is None:
+            print(f"[SDK] No DHT node running; cannot look up {did} in the DHT")
             return None
 
         try:
-            record = AgentRecord.model_validate_json(record_json)
-            # CRITICAL: Verify the public key in the record matches the DID
-            if not self._verify_did(did, record.public_key_pem):
-                print(f"[SDK] SECURITY ALERT: Invalid DID record for {did}. Tampering detected.")
-                return None
+            record = await asyncio.wait_for(self._hedged_lookup(did), self.dht_lookup_timeout)
+        except asyncio.TimeoutError:
+            print(f"[SDK] DHT lookup for {did} timed out after {self.dht_lookup_timeout}s")
+            return None
+        if record is None:
+            print(f"[SDK] DHT lookup FAILED for {did}")
+        return record
 
-            return record
+    def _verified_record(self, did: str, raw) -> Optional[AgentRecord]:
+        """Parses a DHT value; returns it only if its public key hashes to `did`."""
+        try:
+            record = _decode_record(raw)
         except Exception as e:
             print(f"[SDK] Failed to parse record for {did}: {e}")
             return None
+        # CRITICAL: Verify the public key in the record matches the DID
+        if not self._verify_did(did, record.public_key_pem):
+            print(f"[SDK] SECURITY ALERT: Invalid DID record for {did}. Tampering detected.")
+            return None
+        return record
+
+    async def _hedged_lookup(self, did: str) -> Optional[AgentRecord]:
+        """
+        Races the full iterative lookup against direct FIND_VALUEs to the
+        closest known peers and returns the first value that verifies, so one
+        slow or lying peer doesn't hold up (or poison) the result.
+        """
+        from kademlia.node import Node
+        from kademlia.utils import digest
+
+        target = Node(digest(did))
+        nearest = self.dht_node.protocol.router.find_neighbors(target)[:self.dht_hedge]
+
+        async def ask(peer):
+            found, response = await self.dht_node.protocol.call_find_value(peer, target)
+            # Peers without the value answer with their closest contacts instead
+            return response["value"] if found and isinstance(response, dict) else None
+
+        lookups = [asyncio.ensure_future(self.dht_node.get(did))]
+        lookups += [asyncio.ensure_future(ask(peer)) for peer in nearest]
+        try:
+            for next_done in asyncio.as_completed(lookups):
+                try:
+                    raw = await next_done
+                except Exception:
+                    continue
+                if raw:
+                    record = self._verified_record(did, raw)
+                    if record is not None:
+                        return record
+            return None
+        finally:
+            # Don't cancel the losers: rpcudp resolves its futures without checking
+            # for cancellation, so late replies would raise. They end within rpc_timeout.
+            for lookup in lookups:
+                lookup.add_done_callback(_discard_result)
 
     # --- 4. Network Methods ---
 
     async def register(self, public_endpoint: str, capabilities: list,
-                       price: float = 0.0, payment_method: str = "none"):
-        """Registers agent with the network (DHT + Indexer)."""
+                       price: float = 0.0, payment_method: str = "none",
+                       cacheable: bool = False, cache_ttl: float = 0.0):
+        """
+        Registers agent with the network (DHT + Indexer).
+
+        Set `cacheable` (and optionally `cache_ttl`) if identical requests always
+        get identical answers, so callers using a CachePolicy may reuse them.
+        """
+        agent_record = await self._prepare_registration(public_endpoint, price, payment_method,
+                                                        cacheable, cache_ttl)
+
+        async def publish_to_cache():
+            # SPRINT 9: DEMO MODE - Also publish to central cache. Every mode does
+            # this, so start_client() agents (no DHT node) can resolve us; the
+            # record is self-certifying, since its DID is the hash of the key
+            cache_record = self._cache_record(agent_record, capabilities)
+            r = await self.http_client.post(f"{self.registry_url}/publish_record", json=cache_record)
+            r.raise_for_status()
+            print(f"[DEMO CACHE] Published record to central cache.")
+
+        async def register_capabilities():
+            # Step 2: Register capabilities with the Indexer
+            reg_payload = {
+                "agent_id": self.did,  # Use our DID
+                "capabilities": capabilities
+            }
+            r = await self.http_client.post(f"{self.registry_url}/register_capabilities", json=reg_payload)
+            r.raise_for_status()
+            print(f"[INDEXER] Successfully registered capabilities for {self.did}.")
 
-        # Step 1: Publish full data record to the DHT
+        # The publications are independent, so run them concurrently
+        publications = [self._with_retries("capability registration", register_capabilities)]
+        if self.dht_node:
+            publications.append(self._with_retries("DHT publish", lambda: self.publish_record(agent_record)))
+            if capabilities:
+                publications.append(self._with_retries("DHT capability index",
+                                                       lambda: self.publish_capabilities(capabilities)))
+        publications.append(self._with_retries("cache publish", publish_to_cache))
+        await asyncio.gather(*publications)
+        if self.dht_node:
+            self._start_republishing()
+
+    async def _prepare_registration(self, public_endpoint: str, price: float = 0.0,
+                                    payment_method: str = "none", cacheable: bool = False,
+                                    cache_ttl: float = 0.0) -> AgentRecord:
+        """Waits for the listener, then builds the record register() publishes."""
+        self.cacheable = cacheable
+        self.cache_ttl = cache_ttl
+
+        # Don't publish an endpoint before the listener behind it is accepting.
+        # Yield once first: a listen_and_join task created just before this call
+        # hasn't run yet, so it hasn't marked the agent as listening
+        if not self._listening:
+            await asyncio.sleep(0)
+        if self._listening:
+            try:
+                await self.wait_until_ready()
+            except asyncio.TimeoutError:
+                print("WARN: Listener is not ready yet; registering anyway")
+        if self.dht_node is None:
+            print(f"WARN: {self.did[:20]}... has no DHT node yet; registering with the registry only "
+                  f"(no DHT record, capability index or republishing)")
+
+        # Step 1: Full data record for the DHT
         agent_record = AgentRecord(
             public_key_pem=self.public_key_pem,
             endpoint=public_endpoint,
             price=price,
-            payment_method=payment_method
+            payment_method=payment_method,
+            uds_path=self.uds_path,
+            cacheable=cacheable,
+            cache_ttl=cache_ttl,
+            seq=self._next_seq()
         )
-        await self.publish_record(agent_record)
-
-        # SPRINT 9: DEMO MODE - Also publish to central cache
-        if self.demo_mode:
-            cache_record = {
-                "did": self.did,
-                "endpoint": public_endpoint,
-                "public_key_pem": self.public_key_pem,
-                "capabilities": capabilities,
-                "price": price
-            }
-            try:
-                r = await self.http_client.post(f"{self.registry_url}/publish_record", json=cache_record)
-                r.raise_for_status()
-                print(f"[DEMO CACHE] Published record to central cache for 100% reliability.")
-            except httpx.RequestError as e:
-                print(f"WARN: Failed to publish to cache (proceeding with DHT only): {e}")
-
-        # Step 2: Register capabilities with the Indexer
-        reg_payload = {
-            "agent_id": self.did,  # Use our DID
-            "capabilities": capabilities
+        if self._lan:
+            self._lan.set_record(agent_record)
+        return agent_record
+
+    def _cache_record(self, record: AgentRecord, capabilities: List[str]) -> Dict[str, Any]:
+        """The registry's central-cache form of `record` (see /publish_record)."""
+        return {
+            "did": self.did,
+            "endpoint": record.endpoint,
+            "public_key_pem": self.public_key_pem,
+            "capabilities": capabilities,
+            "price": record.price,
+            "uds_path": record.uds_path,
+            "cacheable": record.cacheable,
+            "cache_ttl": record.cache_ttl
         }
+
+    async def _with_retries(self, label: str, operation: Callable, attempts: int = 3,
+                            base_delay: float = 0.2) -> bool:
+        """Runs `operation` until it succeeds (no exception, not False), backing off between attempts."""
+        for attempt in range(1, attempts + 1):
+            try:
+                if await operation() is not False:
+                    return True
+                error = "not accepted"
+            except (httpx.HTTPError, OSError, asyncio.TimeoutError) as e:
+                error = e
+            if attempt < attempts:
+                await asyncio.sleep(base_delay * 2 ** (attempt - 1))
+        print(f"WARN: {label} failed after {attempts} attempts: {error}")
+        return False
+
+    async def _discover_from_registry(self, target_did: str) -> Optional[AgentRecord]:
+        """Looks up (and verifies) an agent's record in the registry's central cache."""
         try:
-            r = await self.http_client.post(f"{self.registry_url}/register_capabilities", json=reg_payload)
-            r.raise_for_status()
-            print(f"[INDEXER] Successfully registered capabilities for {self.did}.")
-        except httpx.RequestError as e:
-            print(f"ERROR: Failed to register capabilities. {e}")
+            r = await self.http_client.get(f"{self.registry_url}/discover/{target_did}", timeout=2)
+            if r.status_code == 200:
+                record_dict = r.json()
+                record = AgentRecord(
+                    public_key_pem=record_dict["public_key_pem"],
+                    endpoint=record_dict["endpoint"],
+                    price=record_dict["price"],
+                    payment_method="none",
+                    uds_path=record_dict.get("uds_path"),
+                    cacheable=record_dict.get("cacheable", False),
+                    cache_ttl=record_dict.get("cache_ttl", 0.0)
+                )
+                # Still verify DID even from cache
+                if self._verify_did(target_did, record.public_key_pem):
+                    print(f"[DEMO CACHE] ✅ Found {target_did} in cache (100% reliable)")
+                    return record
+                else:
+                    print(f"[DEMO CACHE] ❌ DID verification failed for cached record")
+        except Exception as e:
+            print(f"[DEMO CACHE] Cache lookup failed: {e}")
+        return None
+
+    async def start_lan_discovery(self, interface: str = "0.0.0.0", group: str = _LAN_GROUP,
+                                  port: int = _LAN_PORT, announce_interval: float = 30.0,
+                                  lookup_timeout: float = 0.25) -> bool:
+        """
+        Joins the LAN multicast group to announce this agent and find neighbours
+        without the registry or the DHT. Use interface="127.0.0.1" for agents on
+        one host only. Discovery tries the LAN table first, then multicasts a
+        query and waits up to `lookup_timeout` before falling back.
+        """
+        lan = _LanDiscovery(self.did, self._sign, group, port, interface, announce_interval)
+        try:
+            await lan.start()
+        except OSError as e:
+            print(f"[LAN] WARN: Could not join multicast group {group}:{port} on {interface}: {e}")
+            return False
+        self._lan = lan
+        self.lan_lookup_timeout = lookup_timeout
+        if self._published_record:
+            lan.set_record(self._published_record)
+        print(f"[LAN] Discovery enabled on {group}:{port} via {interface}")
+        return True
+
+    def stop_lan_discovery(self):
+        if self._lan:
+            self._lan.close()
+            self._lan = None
 
     async def _discover(self, target_did: str) -> Optional[AgentRecord]:
-        """Discovers another agent's info from the DHT with cache fallback in demo mode."""
+        """
+        Discovers another agent's info, from the local cache or the network.
+
+        Cache entries are (record, fetched_at, validated_at). A versioned record
+        older than discovery_ttl is kept if the DHT version key still matches
+        its seq, until discovery_max_age forces a full refetch.
+        """
+        entry = self._discovery_cache.get(target_did)
+        if entry is not None:
+            record, fetched_at, validated_at = entry
+            now = time.monotonic()
+            if now - validated_at < self.discovery_ttl:
+                return record
+            if record.seq and await self.fetch_record_version(target_did) == record.seq:
+                self._discovery_cache.put(target_did, (record, fetched_at, now),
+                                          self.discovery_max_age - (now - fetched_at))
+                return record
+
+        record = await self._discover_uncached(target_did)
+        if record is not None:
+            now = time.monotonic()
+            # Unversioned records can't be revalidated, so they expire at discovery_ttl
+            max_age = self.discovery_max_age if record.seq else self.discovery_ttl
+            self._discovery_cache.put(target_did, (record, now, now), max(max_age, self.discovery_ttl))
+        return record
+
+    async def _discover_uncached(self, target_did: str) -> Optional[AgentRecord]:
+        """
+        Discovers another agent's info from the DHT, falling back to the registry
+        cache (asked first in demo mode, and only there without a DHT node).
+        Client-only agents publish nowhere else, so providers find them this way.
+        """
+        # Neighbours on the same segment answer without leaving the host/LAN
+        if self._lan:
+            record = await self._lan.lookup(target_did, self.lan_lookup_timeout)
+            if record is not None:
+                return record
+
+        # The host's shared snapshot answers without a round trip, even with the registry down
+        if self.registry_snapshot:
+            record = self.registry_snapshot.lookup(target_did)
+            if record is not None and self._verify_did(target_did, record.public_key_pem):
+                return record
+
         # SPRINT 9: DEMO MODE - Try central cache first
-        if self.demo_mode:
-            try:
-                r = await self.http_client.get(f"{self.registry_url}/discover/{target_did}", timeout=2)
-                if r.status_code == 200:
-                    record_dict = r.json()
-                    record = AgentRecord(
-                        public_key_pem=record_dict["public_key_pem"],
-                        endpoint=record_dict["endpoint"],
-                        price=record_dict["price"],
-                        payment_method="none"
-                    )
-                    # Still verify DID even from cache
-                    if self._verify_did(target_did, record.public_key_pem):
-                        print(f"[DEMO CACHE] ✅ Found {target_did} in cache (100% reliable)")
-                        return record
-                    else:
-                        print(f"[DEMO CACHE] ❌ DID verification failed for cached record")
-            except Exception as e:
-                print(f"[DEMO CACHE] Cache lookup failed, falling back to DHT: {e}")
+        # Client-only agents without a DHT node resolve through the registry as well
+        if self.demo_mode or self.dht_node is None:
+            record = await self._discover_from_registry(target_did)
+            if record or self.dht_node is None:
+                return record
 
         # Standard DHT lookup (or fallback if cache failed)
-        return await self.fetch_record(target_did)
+        record = await self.fetch_record(target_did)
+        if record is None and not self.demo_mode:
+            record = await self._discover_from_registry(target_did)
+        return record
+
+    async def start_client(self, bootstrap_node: Optional[tuple] = None,
+                           dht_host: str = "127.0.0.1", dht_port: int = 0):
+        """
+        Lightweight alternative to listen_and_join for agents that only send.
+
+        No HTTP listener is started. Lookups go through the registry, or through
+        a DHT node on an ephemeral port if `bootstrap_node` is given. The agent's
+        identity record (no endpoint) is published so providers can verify its
+        signatures; they fall back to the registry when it isn't in the DHT.
+
+        There is no read-only DHT mode: with `bootstrap_node` the node is a full
+        Kademlia peer that also stores and serves other agents' records.
+        """
+        if bootstrap_node:
+            await self.start_dht_node(dht_host, dht_port, bootstrap_node)
+
+        identity = AgentRecord(
+            public_key_pem=self.public_key_pem,
+            endpoint="",
+            price=0.0,
+            payment_method="none",
+            seq=self._next_seq()
+        )
+        if self._lan:
+            self._lan.set_record(identity)
+        if self.dht_node:
+            await self.publish_record(identity)
+            self._start_republishing()
+
+        cache_record = {
+            "did": self.did,
+            "endpoint": "",
+            "public_key_pem": self.public_key_pem,
+            "capabilities": [],
+            "price": 0.0
+        }
+        try:
+            r = await self.http_client.post(f"{self.registry_url}/publish_record", json=cache_record)
+            r.raise_for_status()
+            print(f"[CLIENT] Published identity for {self.did} (client-only, no listener)")
+        except httpx.HTTPError as e:
+            print(f"WARN: Failed to publish client identity to registry: {e}")
+
+    def _report_in_background(self, target_did: str, success: bool, response_time_ms: float):
+        """Reports without making the caller wait on the registry round trip."""
+        task = asyncio.ensure_future(self._report_transaction(target_did, success, response_time_ms))
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
 
     async def _report_transaction(self, target_did: str, success: bool, response_time_ms: float):
         """Reports the outcome of a transaction to the registry (async)."""
@@ -255,108 +1834,536 @@ class Agent:
         except httpx.RequestError as e:
             print(f"[SDK] WARN: Failed to report transaction: {e}")
 
-    async def send(self, target_did: str, message_body: Dict[str, Any]) -> Dict[str, Any]:
-        """Sends a secure, signed P2P message (async)."""
+    def _cached_response(self, cache: Optional[CachePolicy], key: str) -> Optional[Dict[str, Any]]:
+        """Returns a fresh copy of a cached response, or None on miss / caching disabled."""
+        if not cache or not cache.enabled:
+            return None
+        cached = self._response_cache_for(cache).get(key)
+        if cached is None:
+            return None
+        print(f"[CACHE] Hit for {key[:40]}...")
+        return json.loads(cached)
+
+    def _store_response(self, cache: Optional[CachePolicy], key: str, response: Any,
+                        cacheable: bool, advertised_ttl: float):
+        """Caches a successful response if both the policy and the provider allow it."""
+        if not cache or not cache.enabled or not _is_cacheable_response(response):
+            return
+        if cache.require_advertised and not cacheable:
+            return
+        ttl = min(cache.ttl, advertised_ttl) if advertised_ttl > 0 else cache.ttl
+        encoded = json.dumps(response)
+        self._response_cache_for(cache).put(key, encoded, ttl, size=len(encoded))
+
+    def _response_cache_for(self, cache: CachePolicy) -> _TTLCache:
+        limits = (cache.max_entries, cache.max_bytes)
+        response_cache = self._response_caches.get(limits)
+        if response_cache is None:
+            response_cache = self._response_caches[limits] = _TTLCache(*limits)
+        return response_cache
+
+    async def send(self, target_did: str, message_body: Dict[str, Any],
+                   cache: Optional[CachePolicy] = None,
+                   idempotency_key: Optional[str] = None,
+                   deadline: Optional[float] = None,
+                   timeout: Optional[float] = None,
+                   capability: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Sends a secure, signed P2P message (async).
+
+        Pass an enabled CachePolicy to reuse responses for identical bodies sent
+        to the same DID instead of making the network call again. Resending with
+        the same `idempotency_key` returns the target's stored response instead of
+        running its handler twice.
+
+        `deadline` (unix time) or `timeout` (seconds) bound the whole call and
+        travel with the message; inside a handler the caller's deadline is
+        inherited. Past the deadline the call returns {"error": "Deadline exceeded"}.
+        `capability` selects the target's route (see route()); execute_task sets it.
+        """
+        # The capability picks the route, so the same body may get a different answer
+        cache_key = f"send:{target_did}:{capability or ''}:{_canonical_hash(message_body)}"
+        cached = self._cached_response(cache, cache_key)
+        if cached is not None:
+            return cached
+
+        deadline = _effective_deadline(deadline, timeout)
+        if deadline is not None and time.time() >= deadline:
+            return {"error": "Deadline exceeded"}
+
         print(f"Sending message from {self.did} to {target_did}...")
 
         start_time = time.perf_counter()
         success = False
         response_json = {}
+        local_agent = self._local_peer(target_did)
 
         try:
-            target_info = await self._discover(target_did)  # This now verifies the DID
+            if local_agent is not None:
+                # Same process: trust is established by construction, so the
+                # body goes straight to the handler without any serialization.
+                response_json = await local_agent._call_handler(self.did, message_body, idempotency_key,
+                                                                deadline, capability)
+                success = True
+                self._store_response(cache, cache_key, response_json,
+                                     local_agent.cacheable, local_agent.cache_ttl)
+                return response_json
+
+            # This now verifies the DID
+            target_info = await _await_until(self._discover(target_did), deadline)
             if not target_info:
                 return {"error": "Failed to discover/verify target agent from DHT"}
 
-            payload_data = {
-                "sender_did": self.did,
-                "body": message_body,
-                "timestamp": time.time()
-            }
-            payload_json = json.dumps(payload_data, sort_keys=True)
-            payload_b64 = base64.b64encode(payload_json.encode('utf-8')).decode('utf-8')
-
-            signature = self._sign(payload_json.encode('utf-8'))
-            signature_b64 = base64.b64encode(signature).decode('utf-8')
+            if self.use_channels:
+                channel_response = await self._send_over_channel(target_did, target_info, message_body,
+                                                                 idempotency_key, deadline, capability)
+                if channel_response is not None:
+                    success = "error" not in channel_response
+                    self._store_response(cache, cache_key, channel_response,
+                                         target_info.cacheable, target_info.cache_ttl)
+                    return channel_response
 
-            signed_message = { "payload": payload_b64, "signature": signature_b64 }
+            signed_message = self._sign_payload(message_body, idempotency_key=idempotency_key,
+                                                deadline=deadline, capability=capability)
 
-            r = await self.http_client.post(
+            r = await self._client_for(target_info).post(
                 f"{target_info.endpoint}/invoke",
                 json=signed_message,
-                timeout=10
+                timeout=_request_timeout(deadline)
             )
+            if r.status_code == 504:
+                return {"error": "Deadline exceeded"}
+            if r.status_code == 503:
+                return {"error": f"Target is overloaded: {r.json().get('detail')}"}
+            if r.status_code == 429:
+                return {"error": "Rate limit exceeded", "retry_after": float(r.headers.get("Retry-After", 1))}
             r.raise_for_status()
             response_json = r.json()
             success = True
+            self._store_response(cache, cache_key, response_json,
+                                 target_info.cacheable, target_info.cache_ttl)
             return response_json
 
         except httpx.RequestError as e:
+            if isinstance(e, httpx.TimeoutException) and deadline is not None and time.time() >= deadline:
+                return {"error": "Deadline exceeded"}
             print(f"ERROR: Message sending failed. {e}")
             return {"error": f"Message sending failed: {e}"}
+        except DeadlineExceeded:
+            return {"error": "Deadline exceeded"}
+        except Exception as e:
+            if local_agent is None:
+                raise
+            print(f"ERROR: In-process handler failed. {e}")
+            return {"error": f"In-process handler failed: {e}"}
 
         finally:
             end_time = time.perf_counter()
             response_time_ms = (end_time - start_time) * 1000.0
-            await self._report_transaction(target_did, success, response_time_ms)
+            self._report_in_background(target_did, success, response_time_ms)
+
+    async def send_stream(self, target_did: str, message_body: Dict[str, Any],
+                          deadline: Optional[float] = None,
+                          timeout: Optional[float] = None,
+                          capability: Optional[str] = None) -> AsyncIterator[Any]:
+        """
+        Sends a signed message to the target's /invoke_stream and yields the
+        response chunks as they arrive (async iterator).
+
+        Each chunk is checked against the hash chain on arrival; the signature
+        over the chain head is checked when the stream ends, so act irreversibly
+        only once iteration finishes without a StreamError. `deadline`/`timeout`
+        work as in send() and raise DeadlineExceeded; `capability` selects the
+        target's route as in send().
+        """
+        deadline = _effective_deadline(deadline, timeout)
+        if deadline is not None and time.time() >= deadline:
+            raise DeadlineExceeded("Deadline exceeded before the stream started")
+
+        local_agent = self._local_peer(target_did)
+        if local_agent is not None:
+            # Same process: nothing to sign or verify, chunks are handed over directly
+            async for item in local_agent._iterate_handler(self.did, message_body, deadline, capability):
+                yield item
+            return
+
+        target_info = await _await_until(self._discover(target_did), deadline)
+        if not target_info:
+            raise StreamError("Failed to discover/verify target agent from DHT")
+
+        signed_message = self._sign_payload(message_body, deadline=deadline, capability=capability)
+        chain = hashlib.sha256(base64.b64decode(signed_message["signature"])).digest()
+        start_time = time.perf_counter()
+        success = False
+        try:
+            # The timeout applies per read, i.e. to the gap between chunks
+            async with self._client_for(target_info).stream(
+                "POST", f"{target_info.endpoint}/invoke_stream",
+                json=signed_message, timeout=_request_timeout(deadline)
+            ) as r:
+                if r.status_code == 504:
+                    raise DeadlineExceeded("Deadline exceeded")
+                r.raise_for_status()
+                seq = 0
+                async for line in r.aiter_lines():
+                    if not line:
+                        continue
+                    frame = json.loads(line)
+                    if frame.get("seq") != seq:
+                        raise StreamError(f"Stream chunk out of order: expected {seq}, got {frame.get('seq')}")
+                    if frame.get("end"):
+                        if "error" in frame:
+                            chain = _chain_hash(chain, {"error": frame["error"]})
+                        signature = base64.b64decode(frame.get("signature", ""))
+                        if frame.get("hash") != chain.hex() or \
+                                not self._verify(chain, signature, target_info.public_key_pem):
+                            raise StreamError("Stream trailer signature is invalid")
+                        if "error" in frame:
+                            if deadline is not None and time.time() >= deadline:
+                                raise DeadlineExceeded(frame["error"])
+                            raise StreamError(f"Remote handler failed: {frame['error']}")
+                        success = True
+                        return
+                    chain = _chain_hash(chain, frame.get("data"))
+                    if frame.get("hash") != chain.hex():
+                        raise StreamError(f"Stream hash chain broken at chunk {seq}")
+                    seq += 1
+                    yield frame["data"]
+            raise StreamError("Stream ended without a signed trailer")
+        except httpx.TimeoutException:
+            if deadline is not None and time.time() >= deadline:
+                raise DeadlineExceeded("Deadline exceeded while streaming")
+            raise
+        finally:
+            response_time_ms = (time.perf_counter() - start_time) * 1000.0
+            self._report_in_background(target_did, success, response_time_ms)
+
+    async def submit(self, target_did: str, message_body: Dict[str, Any],
+                     deadline: Optional[float] = None,
+                     timeout: Optional[float] = None,
+                     capability: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Submits a long-running job to the target's /tasks and returns
+        {"task_id": ..., "status": "accepted"} as soon as it is accepted.
+
+        If this agent is listening, the provider pushes the signed result to
+        our /invoke when the job finishes; otherwise (or if the push is lost)
+        wait_task() polls. Only a future per task is held meanwhile, not a
+        connection. `deadline`/`timeout` bound the job itself; `capability`
+        selects the target's route as in send().
+        """
+        deadline = _effective_deadline(deadline, timeout)
+        task_id = os.urandom(16).hex()
+        # Registered before submitting, so a fast callback always finds its future
+        self._pending_tasks[task_id] = (target_did, asyncio.get_running_loop().create_future())
+
+        local_agent = self._local_peer(target_did)
+        if local_agent is not None:
+            return local_agent._start_task(self.did, task_id, message_body, deadline, callback=True,
+                                           capability=capability)
+
+        try:
+            target_info = await self._discover(target_did)
+            if not target_info:
+                del self._pending_tasks[task_id]
+                return {"error": "Failed to discover/verify target agent from DHT"}
+            signed_message = self._sign_payload(message_body, task_id=task_id, deadline=deadline,
+                                                callback=True if self._listening else None,
+                                                capability=capability)
+            r = await self._client_for(target_info).post(f"{target_info.endpoint}/tasks",
+                                                         json=signed_message, timeout=10)
+            r.raise_for_status()
+            print(f"[TASK] Submitted {task_id} to {target_did[:20]}...")
+            return r.json()
+        except httpx.HTTPError as e:
+            del self._pending_tasks[task_id]
+            print(f"ERROR: Task submission failed. {e}")
+            return {"error": f"Task submission failed: {e}"}
+
+    async def poll_task(self, task_id: str) -> Dict[str, Any]:
+        """Asks the provider for a submitted task's status: running, done (with result) or failed."""
+        pending = self._pending_tasks.get(task_id)
+        if pending is None:
+            received = self._received_tasks.get(task_id)
+            return json.loads(received) if received else {"error": f"Unknown task {task_id}"}
+        target_did = pending[0]
+
+        local_agent = self._local_peer(target_did)
+        if local_agent is not None:
+            status = local_agent._task_status(task_id)
+        else:
+            target_info = await self._discover(target_did)
+            if not target_info:
+                return {"error": "Failed to discover/verify target agent from DHT"}
+            try:
+                r = await self._client_for(target_info).get(f"{target_info.endpoint}/tasks/{task_id}",
+                                                            timeout=10)
+                if r.status_code == 404:
+                    status = None
+                else:
+                    r.raise_for_status()
+                    status = r.json()
+            except httpx.HTTPError as e:
+                return {"error": f"Task poll failed: {e}"}
+        if status is None:
+            # Provider restarted or the outcome expired: the result is gone for good
+            return {"task_id": task_id, "status": "failed", "error": "Task not found at provider"}
+        status.pop("sender_did", None)
+        return status
+
+    async def wait_task(self, task_id: str, timeout: Optional[float] = None) -> Dict[str, Any]:
+        """
+        Waits for a submitted task and returns its result, or {"error": ...}.
+
+        Resolves as soon as the provider's callback arrives; meanwhile polls with
+        exponential backoff starting at `task_poll_interval`. On timeout the task
+        stays pending, so wait_task() can be called again. A pushed result that
+        nobody waits for is dropped after `task_result_ttl`.
+        """
+        pending = self._pending_tasks.get(task_id)
+        if pending is None:
+            received = self._received_tasks.pop(task_id)
+            if received is None:
+                return {"error": f"Unknown task {task_id}"}
+            return self._task_return(json.loads(received))
+        future = pending[1]
+        give_up = None if timeout is None else time.monotonic() + timeout
+        interval = self.task_poll_interval
+        while not future.done():
+            wait = interval if give_up is None else min(interval, give_up - time.monotonic())
+            if wait <= 0:
+                return {"error": f"Timed out waiting for task {task_id}"}
+            await asyncio.wait({future}, timeout=wait)
+            if future.done():
+                break
+            status = await self.poll_task(task_id)
+            if status.get("status") in ("done", "failed") and not future.done():
+                future.set_result(status)
+            interval = min(interval * 2, 30.0)
+
+        self._pending_tasks.pop(task_id, None)
+        return self._task_return(future.result())
+
+    @staticmethod
+    def _task_return(outcome: Dict[str, Any]) -> Dict[str, Any]:
+        if outcome.get("status") == "done":
+            return outcome.get("result")
+        return {"error": outcome.get("error", "Task failed")}
+
+    def _resolve_task(self, provider_did: str, outcome: Dict[str, Any]) -> Dict[str, str]:
+        """
+        Completes a pending task with an outcome pushed by the provider it was
+        submitted to. The outcome moves to _received_tasks, so tasks nobody
+        waits for don't pin memory for the life of the process.
+        """
+        task_id = outcome.get("task_id")
+        pending = self._pending_tasks.get(task_id)
+        if pending is None or pending[0] != provider_did:
+            return {"status": "ignored"}
+        del self._pending_tasks[task_id]
+        if not pending[1].done():
+            pending[1].set_result(outcome)  # Wakes a wait_task() already holding the future
+            encoded = json.dumps(outcome, default=str)
+            self._received_tasks.put(task_id, encoded, self.task_result_ttl, size=len(encoded))
+        print(f"[TASK] Received result for {outcome['task_id']} from {provider_did[:20]}...")
+        return {"status": "received"}
+
+    def start_outbox(self, path: str = "agent_outbox.db", max_batch: int = 64,
+                     max_attempts: int = 20, base_delay: float = 0.5, max_delay: float = 300.0,
+                     concurrency: int = 32, on_result: Optional[Callable] = None):
+        """
+        Enables send_later(): messages are persisted to the SQLite file at `path`
+        and delivered at least once, in batches of up to `max_batch` per peer,
+        retrying with exponential backoff (`base_delay` doubling up to `max_delay`)
+        until `max_attempts`. Messages still queued from an earlier run are resumed.
+
+        `on_result(message_id, target_did, response)` (sync or async) is called
+        when a message is delivered, or with {"error": ...} once it gives up.
+        """
+        self._outbox = _Outbox(path, max_batch, max_attempts, base_delay, max_delay, concurrency)
+        self._outbox_on_result = on_result
+        self._outbox_task = asyncio.create_task(self._run_outbox())
+        print(f"[OUTBOX] Delivering from {path} ({self._outbox.stats()['pending']} queued)")
+
+    def stop_outbox(self):
+        """Stops delivery; undelivered messages stay in the file for the next start_outbox()."""
+        if self._outbox_task:
+            self._outbox_task.cancel()
+            self._outbox_task = None
+        for worker in self._outbox_workers.values():
+            worker.cancel()
+        if self._outbox:
+            self._outbox.close()
+            self._outbox = None
+
+    def send_later(self, target_did: str, message_body: Dict[str, Any],
+                   idempotency_key: Optional[str] = None) -> str:
+        """
+        Queues a message in the durable outbox and returns its ID (which is also
+        its idempotency key) without waiting for the target. Queuing the same
+        `idempotency_key` twice sends it once.
+        """
+        if self._outbox is None:
+            raise RuntimeError("Outbox is not enabled; call start_outbox() first")
+        message_id = idempotency_key or os.urandom(16).hex()
+        self._outbox.add(message_id, target_did, message_body)
+        self._outbox_wakeup.set()
+        return message_id
+
+    def outbox_stats(self) -> Dict[str, int]:
+        """Queued ("pending") and given-up ("dead") message counts, plus peers in flight."""
+        if self._outbox is None:
+            return {"pending": 0, "dead": 0, "in_flight_peers": 0}
+        return dict(self._outbox.stats(), in_flight_peers=len(self._outbox_workers))
+
+    async def _run_outbox(self):
+        """Hands due messages to one delivery worker per peer, up to the outbox's concurrency."""
+        outbox = self._outbox
+        while True:
+            self._outbox_wakeup.clear()
+            if len(self._outbox_workers) < outbox.concurrency:
+                for target_did, rows in outbox.due(time.time(), list(self._outbox_workers)).items():
+                    if len(self._outbox_workers) >= outbox.concurrency:
+                        break
+                    self._outbox_workers[target_did] = asyncio.create_task(
+                        self._deliver_outbox_batch(target_did, rows))
+
+            wait = 1.0
+            if len(self._outbox_workers) < outbox.concurrency:
+                next_due = outbox.next_due(list(self._outbox_workers))
+                if next_due is not None:
+                    wait = min(wait, max(0.0, next_due - time.time()))
+            try:
+                # Woken early by send_later() and by workers finishing
+                await asyncio.wait_for(self._outbox_wakeup.wait(), wait)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _deliver_outbox_batch(self, target_did: str, rows: List[tuple]):
+        outbox = self._outbox
+        try:
+            items = [{"idempotency_key": message_id, "body": body} for message_id, body, _ in rows]
+            try:
+                results = await self._send_batch(target_did, items)
+            except Exception as e:
+                print(f"[OUTBOX] WARN: {len(rows)} message(s) to {target_did[:20]}... not delivered: {e}")
+                dead = outbox.failed(target_did, rows, str(e) or type(e).__name__, peer_down=True)
+                for message_id in dead:
+                    await self._outbox_result(message_id, target_did, {"error": f"Gave up: {e}"})
+                return
+
+            delivered = [row[0] for row, result in zip(rows, results) if "error" not in result]
+            outbox.delivered(delivered)
+            failed = [(row, result["error"]) for row, result in zip(rows, results) if "error" in result]
+            for row, error in failed:
+                # The peer is up but its handler raised: retry this message only
+                for message_id in outbox.failed(target_did, [row], error, peer_down=False):
+                    await self._outbox_result(message_id, target_did, {"error": f"Gave up: {error}"})
+            for row, result in zip(rows, results):
+                if "error" not in result:
+                    await self._outbox_result(row[0], target_did, result["response"])
+        finally:
+            self._outbox_workers.pop(target_did, None)
+            self._outbox_wakeup.set()
+
+    async def _send_batch(self, target_did: str, items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Delivers [{"idempotency_key", "body"}] in one signed /invoke_batch call; per-item results."""
+        local_agent = self._local_peer(target_did)
+        if local_agent is not None:
+            return await local_agent._call_batch(self.did, items)
+
+        target_info = await self._discover(target_did)
+        if not target_info:
+            raise ConnectionError("Failed to discover/verify target agent")
+        signed_message = self._sign_payload({"messages": items})
+        r = await self._client_for(target_info).post(f"{target_info.endpoint}/invoke_batch",
+                                                     json=signed_message, timeout=30)
+        r.raise_for_status()
+        results = r.json()["results"]
+        if len(results) != len(items):
+            raise ValueError(f"Batch answered {len(results)} of {len(items)} messages")
+        return results
+
+    async def _outbox_result(self, message_id: str, target_did: str, response: Any):
+        if self._outbox_on_result is None:
+            return
+        try:
+            result = self._outbox_on_result(message_id, target_did, response)
+            if hasattr(result, '__await__'):
+                await result
+        except Exception as e:
+            print(f"[OUTBOX] WARN: on_result callback failed for {message_id}: {e}")
 
     # --- 5. Economic Decision Engine (async) ---
 
     async def execute_task(self, capability: str, message_body: Dict[str, Any],
-                           policy: Dict[str, float] = None) -> Dict[str, Any]:
-        """Finds the BEST agent for a capability and sends it a message."""
+                           policy: Dict[str, float] = None,
+                           cache: Optional[CachePolicy] = None,
+                           idempotency_key: Optional[str] = None,
+                           deadline: Optional[float] = None,
+                           timeout: Optional[float] = None) -> Dict[str, Any]:
+        """
+        Finds the BEST agent for a capability and sends it a message.
+
+        With an enabled CachePolicy, a repeated (capability, body) pair is answered
+        from the local cache, skipping search, discovery, signing and the network hop.
+        `deadline`/`timeout` bound the whole task, as in send().
+        A 'load' weight in `policy` favours candidates whose heartbeats report
+        the fewest requests running and queued (see start_heartbeat()).
+        """
+        cache_key = f"cap:{capability}:{_canonical_hash(message_body)}"
+        cached = self._cached_response(cache, cache_key)
+        if cached is not None:
+            return cached
+
+        deadline = _effective_deadline(deadline, timeout)
+
         print(f"\n[SDK] Searching for agent with capability: '{capability}'")
 
         if policy is None:
             policy = self.default_policy
 
-        # --- Step 1: Search Indexer ---
+        # --- Step 1: Search the DHT capability index (and/or the Indexer) ---
+        # Steps 1-3 stop waiting at the deadline like the send itself
         try:
-            r = await self.http_client.get(f"{self.registry_url}/search", params={"capability": capability})
-            r.raise_for_status()
-            did_list = r.json()  # List[str] of DIDs
-        except httpx.RequestError as e:
-            return {"error": f"Failed to search for capability: {e}"}
+            did_list = await _await_until(self._search_capability(capability), deadline)
+        except DeadlineExceeded:
+            return {"error": "Deadline exceeded"}
 
         if not did_list:
             return {"error": f"No agents found with capability: {capability}"}
 
-        print(f"[SDK] Found {len(did_list)} candidates from Indexer: {did_list}")
+        print(f"[SDK] Found {len(did_list)} candidates: {did_list}")
 
         # --- Step 2 & 3: Fetch Data (DHT) and Reputations (Indexer) in Parallel ---
-        try:
-            # Fetch all agent records from DHT (with verification)
-            record_tasks = [self._discover(did) for did in did_list]  # _discover now verifies
+        # Fetch all agent records from DHT (with verification)
+        record_tasks = [self._discover(did) for did in did_list]  # _discover now verifies
 
-            # Fetch all reputations from Indexer
-            rep_task = self.http_client.post(f"{self.registry_url}/get_reputations",
-                                           json={"agent_ids": did_list})
-
-            # Run all lookups concurrently
-            results = await asyncio.gather(*record_tasks, rep_task)
-
-            records = results[:-1]  # List[Optional[AgentRecord]]
-            rep_response = results[-1].json()
-
-            # Parse reputation data
-            reputations = {}
-            for did, stats_dict in rep_response['reputations'].items():
-                reputations[did] = ReputationStats(**stats_dict)
+        # Run all lookups concurrently
+        try:
+            results = await _await_until(asyncio.gather(*record_tasks, self._fetch_reputations(did_list)),
+                                         deadline)
+        except DeadlineExceeded:
+            return {"error": "Deadline exceeded"}
 
-        except (httpx.RequestError, json.JSONDecodeError) as e:
-            return {"error": f"Failed during data/reputation fetching: {e}"}
+        records = results[:-1]  # List[Optional[AgentRecord]]
+        reputations = results[-1]
 
         # --- Step 4: Rank Candidates ---
         candidates_data = []
         for i, record in enumerate(records):
             if record:  # Check if DHT lookup AND verification was successful
                 did = did_list[i]
+                load = reputations[did].load
                 candidates_data.append({
                     "did": did,  # Use DID as the key
                     "price": record.price,
-                    "reputation": reputations[did].reputation_score
+                    "reputation": reputations[did].reputation_score,
+                    # Reported in-flight + queued, plus our own sends since; None without a heartbeat
+                    "load": None if load is None else load.in_flight + load.queued + self._dispatched.get(did, 0)
                 })
-                print(f"[SDK] Verified candidate: {did[:20]}... - Price: ${record.price}, Rep: {reputations[did].reputation_score:.2f}")
+                print(f"[SDK] Verified candidate: {did[:20]}... - Price: ${record.price}, Rep: {reputations[did].reputation_score:.2f}"
+                      + ("" if load is None else f", Load: {load.in_flight} running/{load.queued} queued, p95 {load.p95_ms:.0f}ms"))
             else:
                 print(f"[SDK] Discarding invalid/unfound candidate: {did_list[i]}")
 
@@ -367,7 +2374,7 @@ class Agent:
             winner_did = candidates_data[0]['did']
             print(f"[SDK] Only one verified candidate: {winner_did}")
         else:
-            print(f"\\n[SDK] Ranking {len(candidates_data)} verified candidates by policy: Price={policy.get('price', 0.5)*100:.0f}%, Reputation={policy.get('reputation', 0.5)*100:.0f}%")
+            print(f"\\n[SDK] Ranking {len(candidates_data)} verified candidates by policy: Price={policy.get('price', 0.5)*100:.0f}%, Reputation={policy.get('reputation', 0.5)*100:.0f}%, Load={policy.get('load', 0.0)*100:.0f}%")
 
             # Normalize Price (lower is better)
             prices = [c['price'] for c in candidates_data]
@@ -379,6 +2386,11 @@ class Agent:
             min_rep = min(reps)
             max_rep = max(reps)
 
+            # Normalize Load (lower is better); candidates without a heartbeat score neutral
+            loads = [c['load'] for c in candidates_data if c['load'] is not None]
+            min_load = min(loads, default=0)
+            max_load = max(loads, default=0)
+
             scored_candidates = []
             for c in candidates_data:
                 # Price scoring (inverted - lower is better)
@@ -393,12 +2405,21 @@ class Agent:
                 else:
                     rep_score = (c['reputation'] - min_rep) / (max_rep - min_rep)
 
+                # Load scoring (inverted - least loaded is best)
+                if c['load'] is None:
+                    load_score = 0.5
+                elif max_load == min_load:
+                    load_score = 1.0
+                else:
+                    load_score = 1.0 - ((c['load'] - min_load) / (max_load - min_load))
+
                 # Calculate utility
                 utility_score = (price_score * policy.get('price', 0.5)) + \
-                               (rep_score * policy.get('reputation', 0.5))
+                               (rep_score * policy.get('reputation', 0.5)) + \
+                               (load_score * policy.get('load', 0.0))
 
                 scored_candidates.append((utility_score, c))
-                print(f"  - {c['did'][:20]}...: Price=${c['price']:.2f}, Rep={c['reputation']:.2f}, Utility={utility_score:.3f}")
+                print(f"  - {c['did'][:20]}...: Price=${c['price']:.2f}, Rep={c['reputation']:.2f}, Load={c['load']}, Utility={utility_score:.3f}")
 
             # Sort by highest utility
             scored_candidates.sort(key=lambda x: x[0], reverse=True)
@@ -407,7 +2428,150 @@ class Agent:
         print(f"\\n[SDK] Winner selected: {winner_did}")
 
         # --- Step 5: Send message to winner ---
-        return await self.send(target_did=winner_did, message_body=message_body)
+        # Counted until it returns, so concurrent tasks don't all pile onto the
+        # same least-loaded agent before its next heartbeat
+        self._dispatched[winner_did] = self._dispatched.get(winner_did, 0) + 1
+        try:
+            response = await self.send(target_did=winner_did, message_body=message_body,
+                                       idempotency_key=idempotency_key, deadline=deadline,
+                                       capability=capability)
+        finally:
+            self._dispatched[winner_did] -= 1
+            if not self._dispatched[winner_did]:
+                del self._dispatched[winner_did]
+        winner_record = records[did_list.index(winner_did)]
+        self._store_response(cache, cache_key, response,
+                             winner_record.cacheable, winner_record.cache_ttl)
+        return response
+
+    def _local_uds(self, record: AgentRecord) -> Optional[str]:
+        """Returns the target's Unix socket path if it lives on this host."""
+        if not record.uds_path or not os.path.exists(record.uds_path):
+            return None
+        host = urlparse(record.endpoint).hostname
+        if host not in ("127.0.0.1", "localhost", "::1", socket.gethostname()):
+            return None
+        return record.uds_path
+
+    def _client_for(self, record: AgentRecord) -> httpx.AsyncClient:
+        """Picks the HTTP client for a target: its Unix socket if it lives on this host, else TCP."""
+        if not self._local_uds(record):
+            return self.http_client
+
+        client = self._uds_clients.get(record.uds_path)
+        if client is None:
+            client = httpx.AsyncClient(transport=httpx.AsyncHTTPTransport(uds=record.uds_path))
+            self._uds_clients[record.uds_path] = client
+        return client
+
+    async def _send_over_channel(self, target_did: str, record: AgentRecord,
+                                 message_body: Dict[str, Any],
+                                 idempotency_key: Optional[str] = None,
+                                 deadline: Optional[float] = None,
+                                 capability: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """
+        Sends over the persistent channel to `target_did`; None means fall back to HTTP.
+
+        Falling back is only safe while the frame hasn't reached the peer. Once it
+        has, the handler may be running, so a timeout or a dropped channel is
+        retried over HTTP only with an idempotency key (the listener then joins
+        or replays the first run); otherwise it is reported as an error.
+        """
+        try:
+            channel = await self._get_channel(target_did, record)
+        except ImportError:
+            print("[CHANNEL] 'websockets' is not installed; using HTTP POST")
+            self.use_channels = False
+            return None
+        except Exception as e:
+            print(f"[CHANNEL] Channel to {target_did[:20]}... could not be opened, falling back to HTTP: {e}")
+            return None
+
+        try:
+            return await channel.request(message_body, timeout=_request_timeout(deadline),
+                                         idempotency_key=idempotency_key, deadline=deadline,
+                                         capability=capability)
+        except asyncio.TimeoutError:
+            if deadline is not None and time.time() >= deadline:
+                # Out of budget: retrying over HTTP would only run past the deadline
+                return {"error": "Deadline exceeded"}
+            error = "timed out"
+        except _FrameNotSent as e:
+            print(f"[CHANNEL] Channel to {target_did[:20]}... closed before sending, falling back to HTTP: {e}")
+            await self._drop_channel(target_did)
+            return None
+        except Exception as e:
+            await self._drop_channel(target_did)
+            error = f"dropped: {e}"
+
+        if idempotency_key:
+            print(f"[CHANNEL] Channel to {target_did[:20]}... {error}, retrying idempotently over HTTP")
+            return None
+        print(f"[CHANNEL] Channel to {target_did[:20]}... {error} after the request was sent")
+        return {"error": f"Channel to target {error} after the request was sent"}
+
+    async def _drop_channel(self, target_did: str):
+        channel = self._channels.pop(target_did, None)
+        if channel:
+            await channel.close()
+
+    async def _get_channel(self, target_did: str, record: AgentRecord) -> _PeerChannel:
+        """Returns an open channel to the peer, dialing and authenticating it if needed."""
+        channel = self._channels.get(target_did)
+        if channel and channel.is_open:
+            return channel
+
+        lock = self._channel_locks.setdefault(target_did, asyncio.Lock())
+        async with lock:
+            channel = self._channels.get(target_did)
+            if channel and channel.is_open:
+                return channel
+
+            import websockets  # Optional dependency, only needed for channels
+
+            url = record.endpoint.replace("https://", "wss://", 1).replace("http://", "ws://", 1) + "/channel"
+            uds_path = self._local_uds(record)
+            if uds_path:
+                websocket = await websockets.unix_connect(uds_path, url, open_timeout=5)
+            else:
+                websocket = await websockets.connect(url, open_timeout=5)
+
+            # Authenticate once: sign the listener's challenge
+            challenge = json.loads(await asyncio.wait_for(websocket.recv(), 5))["challenge"]
+            await websocket.send(json.dumps(self._sign_payload({"challenge": challenge})))
+            ready = json.loads(await asyncio.wait_for(websocket.recv(), 5))
+            if ready.get("status") != "ready":
+                await websocket.close()
+                raise ConnectionError(f"Channel handshake rejected: {ready}")
+
+            channel = _PeerChannel(target_did, websocket)
+            self._channels[target_did] = channel
+            print(f"[CHANNEL] Opened channel to {target_did[:20]}...")
+
+            if self._channel_sweeper is None or self._channel_sweeper.done():
+                self._channel_sweeper = asyncio.create_task(self._sweep_idle_channels())
+            return channel
+
+    async def _sweep_idle_channels(self):
+        """Closes channels that have carried no traffic for `channel_idle_timeout` seconds."""
+        while self._channels:
+            await asyncio.sleep(self.channel_idle_timeout / 2)
+            now = time.monotonic()
+            for did, channel in list(self._channels.items()):
+                expired = channel.idle and now - channel.last_used > self.channel_idle_timeout
+                if expired or not channel.is_open:
+                    del self._channels[did]
+                    await channel.close()
+                    print(f"[CHANNEL] Closed idle channel to {did[:20]}...")
+
+    def _local_peer(self, target_did: str) -> Optional["Agent"]:
+        """Returns the co-located agent for `target_did` if the in-process path applies."""
+        if not self.local_transport:
+            return None
+        local_agent = _LOCAL_AGENTS.get(target_did)
+        if local_agent is None or local_agent is self or not local_agent._handles_messages():
+            return None
+        return local_agent
 
     # --- 6. Listener ---
 
@@ -416,69 +2580,936 @@ class Agent:
         self._message_handler = func
         return func
 
+    def route(self, name: str, handler: Optional[Callable] = None, concurrency: Optional[int] = None,
+              queue_size: int = 100, timeout: Optional[float] = None):
+        """
+        Registers a handler for one capability or action (usable as a decorator).
+
+        Messages sent by execute_task(name, ...) or whose body has
+        route_field ("action") == name go to this handler instead of the
+        on_message() one. At most `concurrency` run at once (None: no limit),
+        up to `queue_size` more wait for a slot and the rest get 503; each
+        call, queueing included, is cut off after `timeout` seconds.
+        """
+        def register(func: Callable) -> Callable:
+            self._routes[name] = _Route(name, func, concurrency, queue_size, timeout)
+            return func
+        return register(handler) if handler is not None else register
+
+    def rate_limit(self, sender_rate: Optional[float] = None, sender_burst: Optional[float] = None,
+                   global_rate: Optional[float] = None, global_burst: Optional[float] = None,
+                   capability: Optional[str] = None, max_senders: Optional[int] = None):
+        """
+        Sets token-bucket limits (requests per second; burst defaults to one
+        second's worth) for each sender DID and for the listener as a whole.
+        With `capability`, the limits apply to that capability/action only, on
+        top of the agent-wide ones. Over-limit requests get 429 with
+        Retry-After before their signature is verified. At most `max_senders`
+        sender buckets are kept (least recently seen are dropped).
+        """
+        def limit(rate, burst):
+            return (rate, burst if burst is not None else max(1.0, rate)) if rate else None
+
+        self._rate_limiter.configure(capability or "*", limit(sender_rate, sender_burst),
+                                     limit(global_rate, global_burst))
+        if max_senders is not None:
+            self._rate_limiter.max_senders = max_senders
+
+    def _all_routes(self) -> Dict[str, _Route]:
+        routes = dict(self._routes)
+        if self._default_route is not None:
+            routes.setdefault("default", self._default_route)
+        return routes
+
+    def route_stats(self) -> Dict[str, Dict[str, Any]]:
+        """Per-route load and latency: in flight, queued, rejected, timeouts, errors, p50/p95/p99."""
+        return {name: route.stats() for name, route in self._all_routes().items()}
+
+    def metrics_text(self) -> str:
+        """Route statistics in the Prometheus text exposition format (served at GET /metrics)."""
+        routes = self._all_routes()
+        lines = ["# HELP agentweb_route_latency_seconds Time from arrival to handler completion, per route",
+                 "# TYPE agentweb_route_latency_seconds histogram"]
+        for name, route in routes.items():
+            histogram, cumulative = route.latency, 0
+            for bound, count in zip(histogram.buckets + ("+Inf",), histogram.counts):
+                cumulative += count
+                lines.append(f'agentweb_route_latency_seconds_bucket{{route="{name}",le="{bound}"}} {cumulative}')
+            lines.append(f'agentweb_route_latency_seconds_sum{{route="{name}"}} {histogram.sum}')
+            lines.append(f'agentweb_route_latency_seconds_count{{route="{name}"}} {histogram.count}')
+        for metric, kind, attribute in (("in_flight", "gauge", "in_flight"), ("queued", "gauge", "queued"),
+                                        ("rejected_total", "counter", "rejected"),
+                                        ("timeouts_total", "counter", "timeouts"),
+                                        ("errors_total", "counter", "errors")):
+            lines.append(f"# TYPE agentweb_route_{metric} {kind}")
+            for name, route in routes.items():
+                lines.append(f'agentweb_route_{metric}{{route="{name}"}} {getattr(route, attribute)}')
+        lines.append("# TYPE agentweb_rate_limited_total counter")
+        lines.append(f"agentweb_rate_limited_total {self._rate_limiter.rejected}")
+        return "\n".join(lines) + "\n"
+
+    def load_report(self, reset: bool = False) -> Dict[str, Any]:
+        """
+        Current load summed over all routes: handlers in flight, requests queued
+        for a slot, and the p95 of handler latency since the last reset (each
+        heartbeat resets it).
+        """
+        window = _LatencyHistogram()
+        in_flight = queued = 0
+        baseline = {}
+        for name, route in self._all_routes().items():
+            in_flight += route.in_flight
+            queued += route.queued
+            counts = list(route.latency.counts)
+            previous_route, previous = self._load_baseline.get(name, (None, None))
+            if previous_route is not route:
+                previous = [0] * len(counts)  # New or replaced route: everything is recent
+            for i, (now, before) in enumerate(zip(counts, previous)):
+                window.counts[i] += now - before
+                window.count += now - before
+            window.max = max(window.max, route.latency.max)
+            baseline[name] = (route, counts)
+        if reset:
+            self._load_baseline = baseline
+        return {"in_flight": in_flight, "queued": queued,
+                "p95_ms": round(window.quantile(0.95) * 1000.0, 3)}
+
+    def start_heartbeat(self, interval: float = 5.0):
+        """
+        Reports load_report() to the registry's /heartbeat every `interval`
+        seconds, signed like a message, so execute_task() callers can pick the
+        least-loaded candidate (policy key 'load').
+        """
+        self.stop_heartbeat()
+        self._heartbeat_task = asyncio.create_task(self._run_heartbeat(interval))
+
+    def stop_heartbeat(self):
+        if self._heartbeat_task:
+            self._heartbeat_task.cancel()
+            self._heartbeat_task = None
+
+    async def _run_heartbeat(self, interval: float):
+        healthy = True
+        while True:
+            report = dict(self.load_report(reset=True), interval=interval)
+            heartbeat = dict(self._sign_payload(report), public_key_pem=self.public_key_pem)
+            try:
+                r = await self.http_client.post(f"{self.registry_url}/heartbeat", json=heartbeat, timeout=2)
+                r.raise_for_status()
+                if not healthy:
+                    print(f"[HEARTBEAT] Registry reachable again for {self.did[:20]}...")
+                healthy = True
+            except httpx.HTTPError as e:
+                if healthy:  # Warn once per outage, not every interval
+                    print(f"[HEARTBEAT] WARN: Heartbeat for {self.did[:20]}... failed: {e}")
+                healthy = False
+            await asyncio.sleep(interval)
+
+    def _handles_messages(self) -> bool:
+        return self._message_handler is not None or bool(self._routes)
+
+    def _route_for(self, body: Any, capability: Optional[str] = None) -> _Route:
+        """Picks the route for a message: its capability, then body[route_field], then on_message()."""
+        route = self._routes.get(capability) if capability else None
+        if route is None and isinstance(body, dict):
+            key = body.get(self.route_field)
+            if isinstance(key, str):
+                route = self._routes.get(key)
+        if route is None:
+            if self._message_handler is None:
+                raise NoRouteError(f"No handler for capability {capability!r} / "
+                                  f"{self.route_field} {body.get(self.route_field) if isinstance(body, dict) else None!r}")
+            if self._default_route is None or self._default_route.handler is not self._message_handler:
+                self._default_route = _Route("default", self._message_handler)
+            route = self._default_route
+        return route
+
+    async def _call_handler(self, sender_did: str, body: Dict[str, Any],
+                            idempotency_key: Optional[str] = None,
+                            deadline: Optional[float] = None,
+                            capability: Optional[str] = None) -> Any:
+        """Runs a verified message through the handler, replaying stored responses for repeated keys."""
+        if not idempotency_key:
+            # In-process calls run in the caller's context: don't let its key show through
+            token = _current_idempotency_key.set(None)
+            try:
+                return await self._run_handler_until(sender_did, body, deadline, capability)
+            finally:
+                _current_idempotency_key.reset(token)
+
+        replay_key = (sender_did, idempotency_key)
+        stored = self._idempotency_cache.get(replay_key)
+        if stored is not None:
+            print(f"[IDEMPOTENCY] Replaying stored response for key {idempotency_key} from {sender_did[:20]}...")
+            return json.loads(stored)
+        in_flight = self._idempotent_in_flight.get(replay_key)
+        if in_flight is not None:
+            # The original attempt is still running: wait for it rather than running twice
+            return json.loads(await asyncio.shield(in_flight))
+
+        future = asyncio.get_running_loop().create_future()
+        self._idempotent_in_flight[replay_key] = future
+        token = _current_idempotency_key.set(idempotency_key)
+        try:
+            response = await self._run_handler_until(sender_did, body, deadline, capability)
+            encoded = json.dumps(response, default=str)
+            self._idempotency_cache.put(replay_key, encoded, self.idempotency_ttl, size=len(encoded))
+            future.set_result(encoded)
+            return response
+        except BaseException as e:
+            # Failed attempts are not stored, so a retry runs the handler again
+            future.set_exception(e)
+            future.exception()
+            raise
+        finally:
+            _current_idempotency_key.reset(token)
+            del self._idempotent_in_flight[replay_key]
+
+    async def _run_handler_until(self, sender_did: str, body: Dict[str, Any],
+                                 deadline: Optional[float], capability: Optional[str] = None) -> Any:
+        """
+        Runs the message's route handler within the route's concurrency limit,
+        with `deadline` (capped by the route timeout) visible through
+        current_deadline(), and cancels it (raising DeadlineExceeded) once the
+        deadline passes. Sync handlers can't be interrupted, only refused up front.
+        """
+        route = self._route_for(body, capability)
+        deadline = self._route_deadline(route, deadline)
+        if deadline is not None and deadline <= time.time():
+            raise DeadlineExceeded("Deadline exceeded before the handler started")
+
+        start = time.perf_counter()
+        await route.acquire(deadline)
+        try:
+            if deadline is None:
+                return await self._run_handler(sender_did, body, route.handler)
+            token = _current_deadline.set(deadline)
+            try:
+                # The handler's task copies this context, so nested calls inherit the deadline
+                return await asyncio.wait_for(self._run_handler(sender_did, body, route.handler),
+                                              deadline - time.time())
+            except asyncio.TimeoutError:
+                route.timeouts += 1
+                raise DeadlineExceeded("Deadline exceeded while the handler was running")
+            finally:
+                _current_deadline.reset(token)
+        except DeadlineExceeded:
+            raise
+        except Exception:
+            route.errors += 1
+            raise
+        finally:
+            route.release(time.perf_counter() - start)
+
+    @staticmethod
+    def _route_deadline(route: _Route, deadline: Optional[float]) -> Optional[float]:
+        if route.timeout is None:
+            return deadline
+        route_deadline = time.time() + route.timeout
+        return route_deadline if deadline is None else min(deadline, route_deadline)
+
+    async def _run_handler(self, sender_did: str, body: Dict[str, Any],
+                           handler: Optional[Callable] = None) -> Any:
+        """Calls a handler (can be sync or async; default: on_message's) for a verified message."""
+        handler = handler or self._message_handler
+        # Memoized handlers (see memoize_handler) answer hits without being called
+        cache_lookup = getattr(handler, "cache_lookup", None)
+        if cache_lookup is not None:
+            cached = cache_lookup(body)
+            if cached is not None:
+                return cached
+
+        result = handler(sender_did, body)
+        # Check if it's a coroutine and await if needed
+        if hasattr(result, '__await__'):
+            return await result
+        # Streaming handlers answer plain /invoke calls with all their chunks at once
+        if hasattr(result, '__aiter__'):
+            return [item async for item in result]
+        if inspect.isgenerator(result):
+            return list(result)
+        return result
+
+    async def _iterate_handler(self, sender_did: str, body: Dict[str, Any],
+                               deadline: Optional[float] = None,
+                               capability: Optional[str] = None) -> AsyncIterator[Any]:
+        """
+        Yields a route handler's chunks: each item of an (async) generator
+        handler, or the single result of an ordinary one. The route's slot is
+        held for the whole stream, and each step of an async generator is
+        bounded by `deadline` like _run_handler_until.
+        """
+        route = self._route_for(body, capability)
+        deadline = self._route_deadline(route, deadline)
+        if deadline is not None and time.time() >= deadline:
+            raise DeadlineExceeded("Deadline exceeded before the handler started")
+
+        start = time.perf_counter()
+        await route.acquire(deadline)
+        try:
+            async for item in self._iterate_chunks(route.handler, sender_did, body, deadline):
+                yield item
+        except DeadlineExceeded:
+            route.timeouts += 1
+            raise
+        except Exception:
+            route.errors += 1
+            raise
+        finally:
+            route.release(time.perf_counter() - start)
+
+    async def _iterate_chunks(self, handler: Callable, sender_did: str, body: Dict[str, Any],
+                              deadline: Optional[float]) -> AsyncIterator[Any]:
+        result = handler(sender_did, body)
+        if hasattr(result, '__await__'):
+            result = await result
+        if inspect.isgenerator(result):
+            for item in result:
+                yield item
+            return
+        if not hasattr(result, '__aiter__'):
+            yield result
+            return
+
+        iterator = result.__aiter__()
+        while True:
+            token = _current_deadline.set(deadline)
+            key_token = _current_idempotency_key.set(None)  # Streams carry no idempotency key
+            try:
+                # The step's task copies this context, so nested calls inherit the deadline
+                step = asyncio.ensure_future(iterator.__anext__())
+            finally:
+                _current_idempotency_key.reset(key_token)
+                _current_deadline.reset(token)
+            remaining = None if deadline is None else deadline - time.time()
+            try:
+                item = await asyncio.wait_for(step, remaining)
+            except StopAsyncIteration:
+                return
+            except asyncio.TimeoutError:
+                raise DeadlineExceeded("Deadline exceeded while the handler was streaming")
+            yield item
+
     def _create_listener_app(self):
         """Creates the internal FastAPI app for this agent."""
+        from fastapi import FastAPI, WebSocket
+        from fastapi.responses import PlainTextResponse
+
         app = FastAPI(title=f"Agent Listener: {self.did}")
 
         @app.post("/invoke")
-        async def handle_invoke(message: SignedMessage, request: Request):
-            if not self._message_handler:
-                raise HTTPException(status_code=500, detail="Agent has no message handler")
+        async def handle_invoke(message: SignedMessage):
+            return await self._handle_invoke(message)
 
+        @app.post("/invoke_stream")
+        async def handle_invoke_stream(message: SignedMessage):
+            return await self._handle_invoke_stream(message)
+
+        @app.post("/invoke_batch")
+        async def handle_invoke_batch(message: SignedMessage):
+            return await self._handle_invoke_batch(message)
+
+        @app.get("/metrics", response_class=PlainTextResponse)
+        async def handle_metrics():
+            return self.metrics_text()
+
+        @app.post("/tasks", status_code=202)
+        async def handle_submit(message: SignedMessage):
+            return await self._handle_submit(message)
+
+        @app.get("/tasks/{task_id}")
+        async def handle_task_status(task_id: str):
+            return self._public_task_status(task_id)
+
+        @app.websocket("/channel")
+        async def handle_channel(websocket: WebSocket):
+            await self._handle_channel(websocket)
+
+        return app
+
+    async def _handle_invoke(self, message: SignedMessage) -> Any:
+        """Verifies a signed /invoke message and runs it through the handler."""
+        from fastapi import HTTPException
+
+        sender_did, payload = await self._authenticate(message)
+        if payload.get('task_id'):
+            # A provider pushing the outcome of a task we submitted
+            return self._resolve_task(sender_did, payload['body'])
+        if not self._handles_messages():
+            raise HTTPException(status_code=500, detail="Agent has no message handler")
+        try:
+            return await self._call_handler(sender_did, payload['body'], payload.get('idempotency_key'),
+                                            payload.get('deadline'), payload.get('capability'))
+        except DeadlineExceeded as e:
+            raise HTTPException(status_code=504, detail=str(e))
+        except RouteOverloaded as e:
+            raise HTTPException(status_code=503, detail=str(e))
+        except NoRouteError as e:
+            raise HTTPException(status_code=404, detail=str(e))
+
+    async def _handle_invoke_stream(self, message: SignedMessage):
+        """Verifies a signed /invoke_stream message and streams the handler's chunks as NDJSON."""
+        from fastapi import HTTPException
+        from fastapi.responses import StreamingResponse
+
+        if not self._handles_messages():
+            raise HTTPException(status_code=500, detail="Agent has no message handler")
+        sender_did, payload = await self._authenticate(message)
+        chain = hashlib.sha256(base64.b64decode(message.signature)).digest()
+
+        async def lines():
+            nonlocal chain
+            seq, error = 0, None
             try:
-                payload_json = base64.b64decode(message.payload).decode('utf-8')
-                signature = base64.b64decode(message.signature)
-                payload: Dict = json.loads(payload_json)
-                sender_did = payload['sender_did']
+                async for item in self._iterate_handler(sender_did, payload['body'], payload.get('deadline'),
+                                                        payload.get('capability')):
+                    chain = _chain_hash(chain, item)
+                    yield json.dumps({"seq": seq, "data": item, "hash": chain.hex()}, default=str) + "\n"
+                    seq += 1
             except Exception as e:
-                raise HTTPException(status_code=400, detail=f"Invalid message format: {e}")
+                # Headers are already sent, so failures travel in the (signed) trailer
+                error = str(e) or type(e).__name__
+                chain = _chain_hash(chain, {"error": error})
+                print(f"[STREAM] Handler failed after {seq} chunks: {error}")
+            trailer = {"seq": seq, "end": True, "hash": chain.hex(),
+                       "signature": base64.b64encode(self._sign(chain)).decode('utf-8')}
+            if error is not None:
+                trailer["error"] = error
+            yield json.dumps(trailer) + "\n"
+
+        return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+    async def _handle_invoke_batch(self, message: SignedMessage) -> Dict[str, Any]:
+        """Verifies one signed /invoke_batch message and runs each queued message it carries."""
+        from fastapi import HTTPException
+
+        if not self._handles_messages():
+            raise HTTPException(status_code=500, detail="Agent has no message handler")
+        sender_did, payload = await self._authenticate(message, batch=True)
+        items = payload['body'].get('messages')
+        if not isinstance(items, list):
+            raise HTTPException(status_code=400, detail="Batch without a messages list")
+        return {"results": await self._call_batch(sender_did, items, payload.get('deadline'))}
+
+    async def _call_batch(self, sender_did: str, items: List[Dict[str, Any]],
+                          deadline: Optional[float] = None) -> List[Dict[str, Any]]:
+        """Runs batched messages concurrently; each result is {"response": ...} or {"error": ...}."""
+        async def run(item: Dict[str, Any]) -> Dict[str, Any]:
+            try:
+                response = await self._call_handler(sender_did, item['body'], item.get('idempotency_key'),
+                                                    deadline)
+                return {"response": response}
+            except Exception as e:
+                return {"error": str(e) or type(e).__name__}
+
+        return list(await asyncio.gather(*(run(item) for item in items)))
+
+    async def _handle_submit(self, message: SignedMessage) -> Dict[str, Any]:
+        """Verifies a signed /tasks submission and starts the job in the background."""
+        from fastapi import HTTPException
+
+        if not self._handles_messages():
+            raise HTTPException(status_code=500, detail="Agent has no message handler")
+        sender_did, payload = await self._authenticate(message)
+        task_id = payload.get('task_id')
+        if not task_id:
+            raise HTTPException(status_code=400, detail="Task submission without task_id")
+        existing = self._task_status(task_id)
+        if existing is not None and existing["sender_did"] != sender_did:
+            raise HTTPException(status_code=409, detail="task_id is already in use")
+        return self._start_task(sender_did, task_id, payload['body'], payload.get('deadline'),
+                                bool(payload.get('callback')), payload.get('capability'))
+
+    def _start_task(self, sender_did: str, task_id: str, body: Dict[str, Any],
+                    deadline: Optional[float], callback: bool,
+                    capability: Optional[str] = None) -> Dict[str, Any]:
+        """Starts a verified task unless it is already known (a resubmission); returns its status."""
+        existing = self._task_status(task_id)
+        if existing is not None:
+            existing.pop("sender_did")
+            return existing
+        job = asyncio.create_task(self._run_task(sender_did, task_id, body, deadline, callback, capability))
+        self._running_tasks[task_id] = (sender_did, job)
+        return {"task_id": task_id, "status": "accepted"}
+
+    def _public_task_status(self, task_id: str) -> Dict[str, Any]:
+        """GET /tasks/{task_id}: the random task ID is the only credential, so the sender is left out."""
+        from fastapi import HTTPException
+
+        status = self._task_status(task_id)
+        if status is None:
+            raise HTTPException(status_code=404, detail="Unknown task")
+        status.pop("sender_did")
+        return status
+
+    def _task_status(self, task_id: str) -> Optional[Dict[str, Any]]:
+        """Status of a task this agent runs (including "sender_did"), or None if unknown."""
+        running = self._running_tasks.get(task_id)
+        if running is not None:
+            return {"task_id": task_id, "status": "running", "sender_did": running[0]}
+        stored = self._task_results.get(task_id)
+        return json.loads(stored) if stored is not None else None
+
+    async def _run_task(self, sender_did: str, task_id: str, body: Dict[str, Any],
+                        deadline: Optional[float], callback: bool, capability: Optional[str] = None):
+        # This task copied its context from whoever submitted it, possibly an
+        # in-process caller that was handling a keyed request
+        _current_idempotency_key.set(None)
+        try:
+            result = await self._run_handler_until(sender_did, body, deadline, capability)
+            outcome = {"task_id": task_id, "status": "done", "result": result}
+        except Exception as e:
+            outcome = {"task_id": task_id, "status": "failed", "error": str(e) or type(e).__name__}
+            print(f"[TASK] Task {task_id} failed: {outcome['error']}")
+
+        # Kept for polling until task_result_ttl, whether or not the push succeeds
+        encoded = json.dumps(dict(outcome, sender_did=sender_did), default=str)
+        self._task_results.put(task_id, encoded, self.task_result_ttl, size=len(encoded))
+        del self._running_tasks[task_id]
+        if callback:
+            await self._push_task_result(sender_did, json.loads(encoded))
+
+    async def _push_task_result(self, sender_did: str, outcome: Dict[str, Any]):
+        """Calls back the submitter's /invoke with the signed outcome, retrying with backoff."""
+        outcome.pop("sender_did", None)
+        local_agent = _LOCAL_AGENTS.get(sender_did) if self.local_transport else None
+        if local_agent is not None:
+            local_agent._resolve_task(self.did, outcome)
+            return
+
+        for attempt in range(_TASK_CALLBACK_ATTEMPTS):
+            try:
+                record = await self._discover(sender_did)
+                if not record or not record.endpoint:
+                    return  # Nowhere to push to; the submitter polls
+                signed_message = self._sign_payload(outcome, task_id=outcome["task_id"])
+                r = await self._client_for(record).post(f"{record.endpoint}/invoke",
+                                                        json=signed_message, timeout=10)
+                r.raise_for_status()
+                return
+            except httpx.HTTPError as e:
+                print(f"[TASK] WARN: Callback for {outcome['task_id']} failed (attempt {attempt + 1}): {e}")
+                if attempt + 1 < _TASK_CALLBACK_ATTEMPTS:
+                    await asyncio.sleep(2 ** attempt)
 
-            # Discover sender (using hybrid cache) to get their public key
-            # This step now ALSO verifies the sender's DID
+    async def _authenticate(self, message: SignedMessage, batch: bool = False):
+        """
+        Decodes, rate-limits and verifies a signed message; returns
+        (sender_did, payload) or raises HTTPException. A batch costs one
+        token per message it carries.
+        """
+        from fastapi import HTTPException
+
+        try:
+            payload_json = base64.b64decode(message.payload).decode('utf-8')
+            signature = base64.b64decode(message.signature)
+            payload: Dict = json.loads(payload_json)
+            sender_did = payload['sender_did']
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=f"Invalid message format: {e}")
+
+        # The caller has already given up: skip discovery and verification entirely
+        deadline = payload.get('deadline')
+        if deadline is not None and time.time() >= deadline:
+            raise HTTPException(status_code=504, detail="Deadline exceeded")
+
+        # Over-limit senders are turned away before the expensive part
+        body = payload.get('body')
+        scopes = self._rate_limiter.scopes(body, payload.get('capability'), self.route_field)
+        cost = 1
+        if batch and isinstance(body, dict) and isinstance(body.get('messages'), list):
+            cost = max(1, len(body['messages']))
+        if scopes:
+            self._check_rate(self._rate_limiter.admit(sender_did, scopes, cost))
+
+        # Discover sender (using hybrid cache) to get their public key
+        # This step now ALSO verifies the sender's DID
+        try:
+            sender_record = await _await_until(self._discover(sender_did), deadline)
+        except DeadlineExceeded as e:
+            raise HTTPException(status_code=504, detail=str(e))
+        if not sender_record:
+            raise HTTPException(status_code=403, detail="Could not discover/verify sender identity from DHT")
+
+        # Verify the message signature
+        is_valid = self._verify(
+            payload_json.encode('utf-8'),
+            signature,
+            sender_record.public_key_pem
+        )
+
+        if not is_valid:
+            raise HTTPException(status_code=403, detail="Invalid signature")
+        if scopes:
+            self._check_rate(self._rate_limiter.charge(sender_did, scopes, cost))
+
+        print(f"Received valid message from {sender_did[:20]}...")
+        return sender_did, payload
+
+    @staticmethod
+    def _check_rate(retry_after: float):
+        from fastapi import HTTPException
+
+        if retry_after:
+            raise HTTPException(status_code=429, detail="Rate limit exceeded",
+                                headers={"Retry-After": str(max(1, math.ceil(retry_after)))})
+
+    async def _handle_channel(self, websocket):
+        """Serves one persistent peer channel (see _PeerChannel for the client side)."""
+        from fastapi import WebSocketDisconnect
+
+        await websocket.accept()
+
+        # Authenticate the peer once for the lifetime of the channel
+        challenge = base64.b64encode(os.urandom(18)).decode('utf-8')
+        await websocket.send_json({"challenge": challenge})
+        try:
+            hello = SignedMessage(**await websocket.receive_json())
+            payload_json = base64.b64decode(hello.payload).decode('utf-8')
+            payload: Dict = json.loads(payload_json)
+            sender_did = payload['sender_did']
             sender_record = await self._discover(sender_did)
-            if not sender_record:
-                raise HTTPException(status_code=403, detail="Could not discover/verify sender identity from DHT")
-
-            # Verify the message signature
-            is_valid = self._verify(
-                payload_json.encode('utf-8'),
-                signature,
-                sender_record.public_key_pem
+            authenticated = (
+                payload['body'].get('challenge') == challenge
+                and sender_record is not None
+                and self._verify(payload_json.encode('utf-8'),
+                                 base64.b64decode(hello.signature),
+                                 sender_record.public_key_pem)
             )
+        except Exception:
+            authenticated = False
+        if not authenticated or not self._handles_messages():
+            await websocket.send_json({"status": "rejected"})
+            await websocket.close(code=1008)
+            return
+        await websocket.send_json({"status": "ready"})
+        print(f"[CHANNEL] Accepted channel from {sender_did[:20]}...")
+
+        send_lock = asyncio.Lock()
+        in_flight = set()
+
+        async def serve_frame(frame: Dict[str, Any]):
+            # Error frames carry the HTTP status /invoke would have used, so
+            # the caller sees the same result over either transport
+            try:
+                # The peer is already authenticated, so its own bucket is charged right away
+                scopes = self._rate_limiter.scopes(frame.get("body"), frame.get("capability"), self.route_field)
+                retry_after = scopes and (self._rate_limiter.admit(sender_did, scopes) or
+                                          self._rate_limiter.charge(sender_did, scopes))
+                if retry_after:
+                    reply = {"id": frame["id"], "error": "Rate limit exceeded", "code": 429,
+                             "retry_after": max(1, math.ceil(retry_after))}
+                else:
+                    result = await self._call_handler(sender_did, frame["body"], frame.get("idempotency_key"),
+                                                      frame.get("deadline"), frame.get("capability"))
+                    reply = {"id": frame["id"], "result": result}
+            except DeadlineExceeded as e:
+                reply = {"id": frame.get("id"), "error": str(e), "code": 504}
+            except RouteOverloaded as e:
+                reply = {"id": frame.get("id"), "error": str(e), "code": 503}
+            except NoRouteError as e:
+                reply = {"id": frame.get("id"), "error": str(e), "code": 404}
+            except Exception as e:
+                reply = {"id": frame.get("id"), "error": str(e)}
+            async with send_lock:
+                await websocket.send_json(reply)
 
-            if not is_valid:
-                raise HTTPException(status_code=403, detail="Invalid signature")
+        try:
+            while True:
+                frame = await websocket.receive_json()
+                task = asyncio.create_task(serve_frame(frame))
+                in_flight.add(task)
+                task.add_done_callback(in_flight.discard)
+        except WebSocketDisconnect:
+            pass
+        finally:
+            for task in in_flight:
+                task.cancel()
 
-            print(f"Received valid message from {sender_did[:20]}...")
-            # Call the user's handler (can be sync or async)
-            result = self._message_handler(sender_did, payload['body'])
-            # Check if it's a coroutine and await if needed
-            if hasattr(result, '__await__'):
-                response_body = await result
-            else:
-                response_body = result
-            return response_body
-
-        return app
+    async def wait_until_ready(self, timeout: Optional[float] = 10.0):
+        """Waits for listen_and_join to be serving; raises asyncio.TimeoutError otherwise."""
+        await asyncio.wait_for(self.ready.wait(), timeout)
 
     async def listen_and_join(self, http_host: str, http_port: int,
                             dht_host: str, dht_port: int,
-                            bootstrap_node: Optional[tuple] = None):
+                            bootstrap_node: Optional[tuple] = None,
+                            uds_path: Optional[str] = None,
+                            dht_state_file: Optional[str] = None, **dht_options):
         """
         Runs all agent services (DHT node + FastAPI server) in the same event loop.
         This is the new main entry point for a running agent.
+
+        If `uds_path` is given the listener also binds that Unix domain socket,
+        and `register` advertises it so same-host callers can skip TCP.
+        `dht_state_file` persists the DHT routing table and records across restarts.
+        Other keyword arguments (ksize, alpha, rpc_timeout, lookup_timeout, hedge)
+        are passed to start_dht_node.
         """
+        self._listening = True
+
         # 1. Start the DHT node
-        await self.start_dht_node(dht_host, dht_port, bootstrap_node)
+        await self.start_dht_node(dht_host, dht_port, bootstrap_node, state_file=dht_state_file,
+                                  **dht_options)
 
         # 2. Configure and start the FastAPI (listener) server
+        import uvicorn
+
         app = self._create_listener_app()
         config = uvicorn.Config(app, host=http_host, port=http_port, log_level="info")
         server = uvicorn.Server(config)
+        self._http_server = server
+
+        sockets = None
+        if uds_path:
+            # One server, two sockets: TCP for remote callers, UDS for same-host ones
+            if os.path.exists(uds_path):
+                os.unlink(uds_path)
+            uds_sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            uds_sock.bind(uds_path)
+            os.chmod(uds_path, 0o666)
+            # Not config.bind_socket(): it creates the socket with proto=0, and asyncio
+            # only sets TCP_NODELAY on IPPROTO_TCP sockets, so every response would
+            # wait out Nagle + delayed ACK (~40ms)
+            tcp_sock = socket.socket(socket.AF_INET6 if ":" in http_host else socket.AF_INET,
+                                     socket.SOCK_STREAM, socket.IPPROTO_TCP)
+            tcp_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            tcp_sock.bind((http_host, http_port))
+            sockets = [tcp_sock, uds_sock]
+            self.uds_path = uds_path
 
         print(f"\\n--- Agent {self.did} is LIVE ---")
         print(f"--- HTTP listener on {http_host}:{http_port} ---")
+        if uds_path:
+            print(f"--- Unix socket listener on {uds_path} ---")
         print(f"--- DHT node on {dht_host}:{dht_port} ---\\n")
 
-        # 3. Run the server
-        await server.serve()
\ No newline at end of file
+        # 3. Run the server, reachable in-process for co-located agents meanwhile
+        _LOCAL_AGENTS[self.did] = self
+        serve_task = asyncio.create_task(server.serve(sockets=sockets))
+        try:
+            while not server.started and not serve_task.done():
+                await asyncio.sleep(0.01)
+            if server.started:
+                self.ready.set()
+                print(f"--- Agent {self.did[:20]}... is READY ---")
+            await serve_task
+        finally:
+            if not serve_task.done():
+                serve_task.cancel()
+            self.ready.clear()
+            self._listening = False
+            if _LOCAL_AGENTS.get(self.did) is self:
+                del _LOCAL_AGENTS[self.did]
+            if uds_path and os.path.exists(uds_path):
+                os.unlink(uds_path)
+            self.uds_path = None
+            self._http_server = None
+            self.stop_dht_node()
+
+# --- Multi-Tenant Agent Host ---
+
+class AgentHost:
+    """
+    Serves many Agent identities from one process.
+
+    All hosted agents share one HTTP listener (routed by DID path, so each
+    agent's endpoint is `<public_url>/agents/<did>`), one DHT node, one HTTP
+    connection pool and one discovery cache.
+    """
+
+    def __init__(self, registry_url: str, demo_mode: bool = False,
+                 http_client: Optional[httpx.AsyncClient] = None,
+                 publish_concurrency: int = 32):
+        self.registry_url = registry_url
+        self.demo_mode = demo_mode
+        self.http_client = http_client or httpx.AsyncClient()
+        self.discovery_cache = _TTLCache(max_entries=16384)
+        self.publish_concurrency = publish_concurrency
+        self.agents: Dict[str, Agent] = {}
+        self.dht_node: Optional["KademliaServer"] = None
+        self.public_url: Optional[str] = None
+        self.ready = asyncio.Event()
+        self._http_server = None
+
+    def add_agent(self, key_file: str, **agent_kwargs) -> Agent:
+        """Creates an Agent for `key_file` that runs on this host's shared resources."""
+        agent = Agent(registry_url=self.registry_url, key_file=key_file,
+                      demo_mode=self.demo_mode, http_client=self.http_client, **agent_kwargs)
+        agent._discovery_cache = self.discovery_cache
+        agent.dht_node = self.dht_node
+        self.agents[agent.did] = agent
+        if self.ready.is_set():
+            self._attach(agent)
+        return agent
+
+    def endpoint_for(self, agent: Agent) -> str:
+        """The public endpoint other agents use to reach a hosted agent."""
+        return f"{self.public_url}/agents/{agent.did}"
+
+    def _attach(self, agent: Agent):
+        agent.dht_node = self.dht_node
+        agent._listening = True
+        agent.ready.set()
+        _LOCAL_AGENTS[agent.did] = agent
+
+    def _create_listener_app(self):
+        """One FastAPI app that routes /agents/{did}/... to the hosted agent."""
+        from fastapi import FastAPI, HTTPException, WebSocket
+        from fastapi.responses import PlainTextResponse
+
+        app = FastAPI(title=f"Agent Host ({len(self.agents)} agents)")
+
+        def hosted(did: str) -> Agent:
+            agent = self.agents.get(did)
+            if agent is None:
+                raise HTTPException(status_code=404, detail=f"DID {did} is not hosted here")
+            return agent
+
+        @app.post("/agents/{did}/invoke")
+        async def handle_invoke(did: str, message: SignedMessage):
+            return await hosted(did)._handle_invoke(message)
+
+        @app.post("/agents/{did}/invoke_stream")
+        async def handle_invoke_stream(did: str, message: SignedMessage):
+            return await hosted(did)._handle_invoke_stream(message)
+
+        @app.post("/agents/{did}/invoke_batch")
+        async def handle_invoke_batch(did: str, message: SignedMessage):
+            return await hosted(did)._handle_invoke_batch(message)
+
+        @app.get("/agents/{did}/metrics", response_class=PlainTextResponse)
+        async def handle_metrics(did: str):
+            return hosted(did).metrics_text()
+
+        @app.post("/agents/{did}/tasks", status_code=202)
+        async def handle_submit(did: str, message: SignedMessage):
+            return await hosted(did)._handle_submit(message)
+
+        @app.get("/agents/{did}/tasks/{task_id}")
+        async def handle_task_status(did: str, task_id: str):
+            return hosted(did)._public_task_status(task_id)
+
+        @app.websocket("/agents/{did}/channel")
+        async def handle_channel(did: str, websocket: WebSocket):
+            agent = self.agents.get(did)
+            if agent is None:
+                await websocket.close(code=1008)
+                return
+            await agent._handle_channel(websocket)
+
+        @app.get("/agents")
+        async def list_agents():
+            return {"agents": list(self.agents)}
+
+        return app
+
+    async def register_all(self, registrations: List[Dict[str, Any]]):
+        """
+        Registers many hosted agents at once. Each item holds the `agent` plus the
+        keyword arguments for Agent.register (capabilities, price, ...); the
+        endpoint is filled in. The registry gets one /register_batch call for
+        all of them, and the DHT capability index one write per shard key
+        (not per agent and capability). Each agent's own DHT record is still
+        a separate publish, at most `publish_concurrency` at a time.
+        """
+        if not registrations:
+            return
+        semaphore = asyncio.Semaphore(self.publish_concurrency)
+
+        async def prepare(registration: Dict[str, Any]):
+            options = dict(registration)
+            agent = options.pop("agent")
+            capabilities = list(options.pop("capabilities"))
+            record = await agent._prepare_registration(self.endpoint_for(agent), **options)
+            return agent, record, capabilities
+
+        prepared = await asyncio.gather(*(prepare(r) for r in registrations))
+        lead = prepared[0][0]  # Any hosted agent can run the shared calls
+
+        async def register_batch():
+            records = [agent._cache_record(record, capabilities) for agent, record, capabilities in prepared]
+            r = await self.http_client.post(f"{self.registry_url}/register_batch", json=records)
+            r.raise_for_status()
+            print(f"[INDEXER] Registered {len(records)} hosted agents in one call.")
+
+        async def limited(agent: Agent, label: str, operation: Callable) -> bool:
+            async with semaphore:
+                return await agent._with_retries(label, operation)
+
+        publications = [lead._with_retries("registry batch", register_batch)]
+        index_keys: Dict[str, Dict[str, int]] = {}  # Capability index key -> {did: expires}
+        if self.dht_node:
+            for agent, record, capabilities in prepared:
+                publications.append(limited(agent, "DHT publish",
+                                            functools.partial(agent.publish_record, record)))
+                shard = _cap_index_shard(agent.did)
+                expires = int(time.time() + agent.capability_index_ttl)
+                for capability in capabilities:
+                    index_keys.setdefault(_cap_index_key(capability, shard), {})[agent.did] = expires
+        indexing = [limited(lead, "DHT capability index",
+                            functools.partial(lead._add_cap_entries, key, additions))
+                    for key, additions in index_keys.items()]
+        _, indexed = await asyncio.gather(asyncio.gather(*publications), asyncio.gather(*indexing))
+
+        if self.dht_node:
+            failed = set()
+            for (key, additions), stored in zip(index_keys.items(), indexed):
+                if not stored:
+                    failed.update(additions)
+            for agent, _, capabilities in prepared:
+                if capabilities and agent.did not in failed:
+                    agent._published_capabilities = capabilities
+                agent._start_republishing()
+        print(f"[HOST] Registered {len(registrations)} hosted agents "
+              f"({len(index_keys)} capability index writes)")
+
+    async def wait_until_ready(self, timeout: Optional[float] = 10.0):
+        await asyncio.wait_for(self.ready.wait(), timeout)
+
+    async def serve(self, http_host: str, http_port: int, dht_host: str, dht_port: int,
+                    bootstrap_node: Optional[tuple] = None, public_url: Optional[str] = None,
+                    dht_state_file: Optional[str] = None, snapshot_interval: float = 300.0):
+        """Starts the shared DHT node and HTTP listener and serves all hosted agents."""
+        import uvicorn
+
+        self.public_url = public_url or f"http://{http_host}:{http_port}"
+        self.dht_node = await _start_kademlia_node(dht_host, dht_port, bootstrap_node,
+                                                   label=f"host {self.public_url}",
+                                                   state_file=dht_state_file)
+        snapshot_task = None
+        if dht_state_file:
+            snapshot_task = asyncio.create_task(
+                _snapshot_dht_periodically(self.dht_node, dht_state_file, snapshot_interval))
+
+        config = uvicorn.Config(self._create_listener_app(), host=http_host, port=http_port, log_level="info")
+        server = uvicorn.Server(config)
+        self._http_server = server
+
+        print(f"\n--- Agent host on {http_host}:{http_port} serving {len(self.agents)} agents ---")
+        serve_task = asyncio.create_task(server.serve())
+        try:
+            while not server.started and not serve_task.done():
+                await asyncio.sleep(0.01)
+            if server.started:
+                for agent in self.agents.values():
+                    self._attach(agent)
+                self.ready.set()
+            await serve_task
+        finally:
+            if not serve_task.done():
+                serve_task.cancel()
+            self.ready.clear()
+            for agent in self.agents.values():
+                agent.ready.clear()
+                agent._listening = False
+                if _LOCAL_AGENTS.get(agent.did) is agent:
+                    del _LOCAL_AGENTS[agent.did]
+            self._http_server = None
+            for agent in self.agents.values():
+                if agent._republish_task:
+                    agent._republish_task.cancel()
+                    agent._republish_task = None
+            if snapshot_task:
+                snapshot_task.cancel()
+                _save_dht_snapshot(self.dht_node, dht_state_file)
+            self.dht_node.stop()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Benchmark: cold import time of the agent_web SDK, tracked against a baseline.
+
+Runs `python -X importtime -c "import agent_web"` in fresh interpreters and
+reports the median cumulative import time. Fails (exit 1) if:
+  - a listener/DHT dependency (fastapi, uvicorn, starlette, kademlia) is
+    imported by `import agent_web` alone, or
+  - the median exceeds the recorded baseline by more than the tolerance.
+
+Usage:
+    python benchmarks/bench_import_time.py            # check against baseline
+    python benchmarks/bench_import_time.py --update   # record a new baseline
+"""
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).parent.parent
+BASELINE_FILE = Path(__file__).parent / "import_time_baseline.json"
+
+# Must only load when a listener or DHT node is actually started
+LAZY_MODULES = ("fastapi", "uvicorn", "starlette", "kademlia")
+
+
+def measure_once() -> tuple:
+    """Returns (cumulative microseconds for agent_web, set of top-level modules imported)."""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import agent_web"],
+        cwd=REPO_ROOT, capture_output=True, text=True, check=True
+    )
+    cumulative_us = None
+    modules = set()
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        name = name.strip()
+        if not cumulative.strip().isdigit():
+            continue  # Header line
+        modules.add(name.split(".")[0])
+        if name == "agent_web":
+            cumulative_us = int(cumulative)
+    return cumulative_us, modules
+
+
+def main(runs: int, update: bool, tolerance: float) -> int:
+    samples = []
+    modules = set()
+    for _ in range(runs):
+        cumulative_us, imported = measure_once()
+        samples.append(cumulative_us)
+        modules |= imported
+
+    median_ms = statistics.median(samples) / 1000.0
+    print(f"import agent_web: median {median_ms:.1f}ms over {runs} runs "
+          f"(min {min(samples) / 1000.0:.1f}ms, max {max(samples) / 1000.0:.1f}ms)")
+
+    failed = False
+    eager = sorted(m for m in LAZY_MODULES if m in modules)
+    if eager:
+        print(f"FAIL: imported eagerly by `import agent_web`: {', '.join(eager)}")
+        failed = True
+
+    if update:
+        BASELINE_FILE.write_text(json.dumps({"median_ms": round(median_ms, 1)}, indent=2) + "\n")
+        print(f"Recorded baseline {median_ms:.1f}ms in {BASELINE_FILE.name}")
+    elif BASELINE_FILE.exists():
+        baseline_ms = json.loads(BASELINE_FILE.read_text())["median_ms"]
+        limit_ms = baseline_ms * (1.0 + tolerance)
+        print(f"Baseline {baseline_ms:.1f}ms, limit {limit_ms:.1f}ms (+{tolerance:.0%})")
+        if median_ms > limit_ms:
+            print("FAIL: import time regressed past the baseline")
+            failed = True
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--runs", type=int, default=7)
+    parser.add_argument("--update", action="store_true", help="record the current median as the baseline")
+    parser.add_argument("--tolerance", type=float, default=0.5,
+                        help="allowed slowdown over baseline as a fraction (default 0.5 = +50%%)")
+    args = parser.parse_args()
+    sys.exit(main(args.runs, args.update, args.tolerance))
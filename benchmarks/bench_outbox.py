@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Benchmark: durable outbox (send_later) throughput while the peer is down and up.
+
+Publishes a receiver's record in the DHT but leaves its listener off, queues
+`--messages` messages with send_later(), then starts the listener and times
+the batched drain. The same queue/drain is repeated with the receiver up, and
+compared with awaiting send() one message at a time.
+
+Usage:
+    python benchmarks/bench_outbox.py [--messages 5000] [--batch 64]
+"""
+
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import argparse
+import asyncio
+import contextlib
+import io
+import logging
+import os
+import tempfile
+import time
+
+from agent_web import Agent, AgentRecord
+
+HTTP_PORT = 8621
+RECEIVER_DHT_PORT = 8622
+SENDER_DHT_PORT = 8623
+
+
+def enqueue(sender: Agent, receiver_did: str, count: int) -> float:
+    start = time.perf_counter()
+    for i in range(count):
+        sender.send_later(receiver_did, {"i": i, "payload": "x" * 64})
+    return count / (time.perf_counter() - start)
+
+
+async def publish(agent: Agent, endpoint: str):
+    await agent.publish_record(AgentRecord(public_key_pem=agent.public_key_pem, endpoint=endpoint,
+                                           price=0.0, payment_method="none", seq=agent._next_seq()))
+
+
+async def drain(sender: Agent, timeout: float = 120.0) -> float:
+    start = time.perf_counter()
+    while sender.outbox_stats()["pending"] and time.perf_counter() - start < timeout:
+        await asyncio.sleep(0.01)
+    return time.perf_counter() - start
+
+
+async def main(args):
+    workdir = tempfile.mkdtemp(prefix="poros-bench-")
+    endpoint = f"http://127.0.0.1:{HTTP_PORT}"
+    logging.getLogger("uvicorn.access").setLevel(logging.WARNING)
+    logging.getLogger("kademlia").setLevel(logging.ERROR)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        receiver = Agent(registry_url="http://127.0.0.1:9", key_file=os.path.join(workdir, "receiver.key"),
+                         local_transport=False)
+        sender = Agent(registry_url="http://127.0.0.1:9", key_file=os.path.join(workdir, "sender.key"),
+                       local_transport=False)
+        receiver.on_message(lambda sender_did, body: {"status": "ok"})
+
+        # Receiver is "down": discoverable, but nothing listens on its endpoint
+        await receiver.start_dht_node("127.0.0.1", RECEIVER_DHT_PORT)
+        await sender.start_dht_node("127.0.0.1", SENDER_DHT_PORT, ("127.0.0.1", RECEIVER_DHT_PORT))
+        await publish(receiver, endpoint)
+        await publish(sender, "")
+        sender.start_outbox(os.path.join(workdir, "outbox.db"), max_batch=args.batch,
+                            base_delay=0.05, max_delay=0.5)
+
+    print(f"\n=== {args.messages} messages, batches of up to {args.batch} ===")
+    rate_down = enqueue(sender, receiver.did, args.messages)
+    await asyncio.sleep(0.5)
+    print(f"enqueue, peer down    {rate_down:10.0f} msg/s  ({sender.outbox_stats()['pending']} queued)")
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        receiver.stop_dht_node()
+        await asyncio.sleep(0.1)
+        listen_task = asyncio.create_task(
+            receiver.listen_and_join("127.0.0.1", HTTP_PORT, "127.0.0.1", RECEIVER_DHT_PORT,
+                                     ("127.0.0.1", SENDER_DHT_PORT)))
+        await receiver.wait_until_ready()
+        # The restarted node lost what it stored, which may include the sender's record
+        await publish(receiver, endpoint)
+        await publish(sender, "")
+        elapsed = await drain(sender)
+    print(f"drain after recovery  {args.messages / elapsed:10.0f} msg/s  ({elapsed:.2f}s)")
+
+    rate_up = enqueue(sender, receiver.did, args.messages)
+    print(f"enqueue, peer up      {rate_up:10.0f} msg/s")
+    with contextlib.redirect_stdout(io.StringIO()):
+        elapsed = await drain(sender)
+    print(f"drain, peer up        {args.messages / elapsed:10.0f} msg/s  ({elapsed:.2f}s)")
+
+    rounds = min(args.messages, 500)
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        for i in range(rounds):
+            await sender.send(receiver.did, {"i": i, "payload": "x" * 64})
+        elapsed = time.perf_counter() - start
+    print(f"sequential send()     {rounds / elapsed:10.0f} msg/s  ({rounds} messages)")
+
+    sender.stop_outbox()
+    sender.stop_dht_node()
+    receiver._http_server.should_exit = True
+    await listen_task
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--messages", type=int, default=5000)
+    parser.add_argument("--batch", type=int, default=64)
+    asyncio.run(main(parser.parse_args()))
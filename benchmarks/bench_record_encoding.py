@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Benchmark: DHT record size and lookup latency, JSON vs the compact binary encoding.
+
+Reports, for a typical agent record:
+  - the stored value size and the STORE datagram size as rpcudp sends it
+    (compared with a 1472-byte UDP payload, i.e. a 1500-byte Ethernet MTU),
+  - encode/decode cost,
+  - fetch_record() latency across a small in-process Kademlia network when the
+    same record is stored as legacy JSON and as the binary format.
+
+Usage:
+    python benchmarks/bench_record_encoding.py [--nodes 16] [--lookups 200]
+"""
+
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+
+import umsgpack
+from kademlia.utils import digest
+
+from agent_web import Agent, AgentRecord, _encode_record, _decode_record
+
+BASE_DHT_PORT = 8630
+UDP_PAYLOAD_LIMIT = 1472  # 1500-byte MTU minus IPv4 and UDP headers
+
+
+def store_datagram_size(key: bytes, value) -> int:
+    """Size of the STORE request rpcudp would send: type byte + 20-byte id + msgpack body."""
+    return 1 + 20 + len(umsgpack.packb(["store", [os.urandom(20), key, value]]))
+
+
+def time_call(fn, rounds: int) -> float:
+    start = time.perf_counter()
+    for _ in range(rounds):
+        fn()
+    return (time.perf_counter() - start) / rounds * 1e6
+
+
+def summarize(label: str, samples: list) -> None:
+    samples = sorted(samples)
+    p99 = samples[min(len(samples) - 1, int(len(samples) * 0.99))]
+    print(f"{label:<14} n={len(samples):<5} p50={statistics.median(samples):7.3f}ms p99={p99:7.3f}ms")
+
+
+async def main(nodes: int, lookups: int):
+    workdir = tempfile.mkdtemp(prefix="poros-bench-")
+    agents = [Agent(registry_url="http://127.0.0.1:9", key_file=os.path.join(workdir, f"{i}.key"))
+              for i in range(nodes + 2)]
+    owner_json, owner_binary = agents[-2], agents[-1]
+    agents = agents[:nodes]
+
+    def record_for(agent):
+        return AgentRecord(public_key_pem=agent.public_key_pem, endpoint="https://agents.example.com:8443",
+                           price=0.05, payment_method="points")
+
+    json_value = record_for(owner_json).model_dump_json()
+    binary_value = _encode_record(record_for(owner_binary))
+    key = os.urandom(20)
+
+    print("=== Record size ===")
+    for label, value in (("JSON", json_value), ("binary", binary_value)):
+        size = len(value.encode("utf-8") if isinstance(value, str) else value)
+        datagram = store_datagram_size(key, value)
+        fits = "fits" if datagram <= UDP_PAYLOAD_LIMIT else "FRAGMENTS"
+        print(f"{label:<8} value={size:4d}B  STORE datagram={datagram:4d}B ({fits} in {UDP_PAYLOAD_LIMIT}B)")
+
+    print("\n=== Codec cost (per record) ===")
+    print(f"JSON    encode {time_call(lambda: record_for(owner_json).model_dump_json(), 2000):7.1f}us  "
+          f"decode {time_call(lambda: _decode_record(json_value), 2000):7.1f}us")
+    print(f"binary  encode {time_call(lambda: _encode_record(record_for(owner_binary)), 2000):7.1f}us  "
+          f"decode {time_call(lambda: _decode_record(binary_value), 2000):7.1f}us")
+
+    await agents[0].start_dht_node("127.0.0.1", BASE_DHT_PORT)
+    for i, agent in enumerate(agents[1:], 1):
+        await agent.start_dht_node("127.0.0.1", BASE_DHT_PORT + i, ("127.0.0.1", BASE_DHT_PORT))
+    await agents[1].dht_node.set(owner_json.did, json_value)
+    await agents[1].dht_node.set(owner_binary.did, binary_value)
+
+    print(f"\n=== fetch_record() over {nodes} nodes, {lookups} lookups each ===")
+    for label, did in (("JSON", owner_json.did), ("binary", owner_binary.did)):
+        samples = []
+        for i in range(lookups):
+            # Ask from nodes that don't hold the value locally, so the network is used
+            reader = agents[2 + i % (nodes - 2)]
+            reader.dht_node.storage.data.pop(digest(did), None)
+            start = time.perf_counter()
+            record = await reader.fetch_record(did)
+            samples.append((time.perf_counter() - start) * 1000.0)
+            assert record is not None, f"{label} lookup failed"
+        summarize(label, samples)
+
+    for agent in agents:
+        agent.stop_dht_node()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--nodes", type=int, default=16)
+    parser.add_argument("--lookups", type=int, default=200)
+    args = parser.parse_args()
+    asyncio.run(main(args.nodes, args.lookups))
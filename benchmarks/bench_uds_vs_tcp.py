@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Benchmark: message round-trip latency over loopback TCP vs a Unix domain socket.
+
+Starts one receiver agent listening on both TCP and UDS, and one sender agent
+that joins its DHT. The sender posts the same signed envelope to /invoke over
+each transport, so both sides pay identical signing/verification costs and the
+difference is the transport alone.
+
+Usage:
+    python benchmarks/bench_uds_vs_tcp.py [--rounds 500]
+"""
+
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import argparse
+import asyncio
+import logging
+import os
+import statistics
+import tempfile
+import time
+
+from agent_web import Agent, AgentRecord
+
+HTTP_PORT = 8611
+RECEIVER_DHT_PORT = 8612
+SENDER_DHT_PORT = 8613
+
+
+def summarize(label: str, samples: list) -> None:
+    samples = sorted(samples)
+    p50 = statistics.median(samples)
+    p99 = samples[min(len(samples) - 1, int(len(samples) * 0.99))]
+    print(f"{label:<14} n={len(samples):<5} mean={statistics.mean(samples):7.3f}ms "
+          f"p50={p50:7.3f}ms p99={p99:7.3f}ms")
+
+
+async def time_rounds(client, url: str, signed_message: dict, rounds: int) -> list:
+    samples = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        r = await client.post(url, json=signed_message, timeout=10)
+        r.raise_for_status()
+        samples.append((time.perf_counter() - start) * 1000.0)
+    return samples
+
+
+async def main(rounds: int):
+    workdir = tempfile.mkdtemp(prefix="poros-bench-")
+    uds_path = os.path.join(workdir, "receiver.sock")
+
+    receiver = Agent(registry_url="http://127.0.0.1:9", key_file=os.path.join(workdir, "receiver.key"))
+    sender = Agent(registry_url="http://127.0.0.1:9", key_file=os.path.join(workdir, "sender.key"))
+    receiver.on_message(lambda sender_did, body: {"status": "ok", "echo": body})
+
+    listen_task = asyncio.create_task(
+        receiver.listen_and_join("127.0.0.1", HTTP_PORT, "127.0.0.1", RECEIVER_DHT_PORT,
+                                 uds_path=uds_path)
+    )
+    while not os.path.exists(uds_path):
+        await asyncio.sleep(0.05)
+    logging.getLogger("uvicorn.access").setLevel(logging.WARNING)
+
+    # The receiver verifies the sender's DID through the DHT, so publish it there
+    await sender.start_dht_node("127.0.0.1", SENDER_DHT_PORT, ("127.0.0.1", RECEIVER_DHT_PORT))
+    endpoint = f"http://127.0.0.1:{HTTP_PORT}"
+    await sender.register(endpoint, capabilities=[])
+
+    signed_message = sender._sign_payload({"ping": "x" * 64})
+    url = f"{endpoint}/invoke"
+
+    # Discovery is not under test: build the receiver's record directly
+    record = AgentRecord(public_key_pem=receiver.public_key_pem, endpoint=endpoint,
+                         price=0.0, payment_method="none", uds_path=uds_path)
+    tcp_client = sender.http_client
+    uds_client = sender._client_for(record)
+    assert uds_client is not tcp_client, "UDS path was not selected for a local endpoint"
+
+    # Warm up both connection pools
+    await time_rounds(tcp_client, url, signed_message, 20)
+    await time_rounds(uds_client, url, signed_message, 20)
+
+    print(f"\n=== /invoke round trip, {rounds} rounds each ===")
+    summarize("loopback TCP", await time_rounds(tcp_client, url, signed_message, rounds))
+    summarize("unix socket", await time_rounds(uds_client, url, signed_message, rounds))
+
+    receiver._http_server.should_exit = True
+    await listen_task
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--rounds", type=int, default=500)
+    args = parser.parse_args()
+    asyncio.run(main(args.rounds))
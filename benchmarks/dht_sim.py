@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+"""
+Simulator: many Kademlia nodes in one process, with churn and injected latency/loss.
+
+Starts `--nodes` DHT nodes on loopback (no registry, no network access needed),
+publishes `--records` signed agent records through publish_record(), optionally
+kills and replaces a fraction of the nodes, then runs `--lookups` fetch_record()
+calls from random nodes. Every datagram goes through a wrapper transport that
+adds latency/jitter and drops packets with the given probability.
+
+Reports publish success, lookup p50/p99 latency, lookup success rate and the
+number of UDP messages sent per lookup. All nodes share one event loop, so with
+--concurrency above 1 latencies also include CPU queueing; use --concurrency 1
+for protocol latency alone.
+
+Usage:
+    python benchmarks/dht_sim.py --nodes 500 --latency-ms 5 --jitter-ms 10 --loss 0.02 --churn 0.2
+"""
+
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import argparse
+import asyncio
+import contextlib
+import io
+import logging
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from agent_web import Agent, AgentRecord, _start_kademlia_node
+
+BASE_PORT = 20000
+START_BATCH = 50  # Nodes bootstrapped concurrently
+
+
+class FaultyTransport:
+    """Wraps a datagram transport: counts sends, drops some, delays the rest."""
+
+    def __init__(self, transport, stats: dict, latency: float, jitter: float, loss: float):
+        self._transport = transport
+        self._stats = stats
+        self._latency = latency
+        self._jitter = jitter
+        self._loss = loss
+
+    def sendto(self, data, addr=None):
+        self._stats["sent"] += 1
+        if random.random() < self._loss:
+            self._stats["dropped"] += 1
+            return
+        delay = self._latency + random.random() * self._jitter
+        if delay <= 0:
+            self._transport.sendto(data, addr)
+        else:
+            asyncio.get_running_loop().call_later(delay, self._send_if_open, data, addr)
+
+    def _send_if_open(self, data, addr):
+        if not self._transport.is_closing():
+            self._transport.sendto(data, addr)
+
+    def __getattr__(self, name):
+        return getattr(self._transport, name)
+
+
+def percentile(samples: list, fraction: float) -> float:
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+class Simulation:
+    def __init__(self, args):
+        self.args = args
+        self.stats = {"sent": 0, "dropped": 0}
+        self.nodes = {}  # port -> KademliaServer
+        self.next_port = BASE_PORT
+
+    async def start_node(self, bootstrap: tuple = None):
+        port = self.next_port
+        self.next_port += 1
+        node = await _start_kademlia_node("127.0.0.1", port, bootstrap, label=str(port),
+                                          ksize=self.args.ksize, alpha=self.args.alpha,
+                                          rpc_timeout=self.args.rpc_timeout)
+        node.protocol.transport = FaultyTransport(node.protocol.transport, self.stats,
+                                                  self.args.latency_ms / 1000.0,
+                                                  self.args.jitter_ms / 1000.0, self.args.loss)
+        self.nodes[port] = node
+        return node
+
+    async def start_nodes(self, count: int):
+        """Each new node bootstraps from a random node that is already up."""
+        for batch_start in range(0, count, START_BATCH):
+            live = list(self.nodes)
+            batch = min(START_BATCH, count - batch_start)
+            with contextlib.redirect_stdout(io.StringIO()):
+                await asyncio.gather(*(self.start_node(("127.0.0.1", random.choice(live)))
+                                       for _ in range(batch)))
+
+    def kill_nodes(self, count: int):
+        for port in random.sample(list(self.nodes)[1:], count):
+            self.nodes.pop(port).stop()
+
+    def attach(self, agent: Agent):
+        """Points an agent at a random live node, the way AgentHost shares one node."""
+        agent.dht_node = random.choice(list(self.nodes.values()))
+        agent.dht_lookup_timeout = self.args.lookup_timeout
+        agent.dht_hedge = self.args.hedge
+
+
+async def main(args):
+    random.seed(args.seed)
+    # Timeouts and empty routing tables are expected under loss and churn
+    logging.getLogger("kademlia").setLevel(logging.ERROR)
+    logging.getLogger("rpcudp").setLevel(logging.CRITICAL)
+    sim = Simulation(args)
+    workdir = tempfile.mkdtemp(prefix="poros-dhtsim-")
+
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        await sim.start_node()
+    await sim.start_nodes(args.nodes - 1)
+    print(f"Started {len(sim.nodes)} nodes in {time.perf_counter() - started:.1f}s "
+          f"(ksize={args.ksize}, alpha={args.alpha}, latency={args.latency_ms}ms"
+          f"+{args.jitter_ms}ms, loss={args.loss:.1%})")
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        publishers = [Agent(registry_url="http://127.0.0.1:9", key_file=os.path.join(workdir, f"{i}.key"))
+                      for i in range(args.records)]
+        readers = [Agent(registry_url="http://127.0.0.1:9", key_file=os.path.join(workdir, f"reader{i}.key"))
+                   for i in range(args.concurrency)]
+
+    async def publish(i: int, publisher: Agent) -> bool:
+        sim.attach(publisher)
+        record = AgentRecord(public_key_pem=publisher.public_key_pem, endpoint=f"http://10.0.0.1:{9000 + i}",
+                             price=0.01, payment_method="points", seq=publisher._next_seq())
+        return await publisher.publish_record(record)
+
+    sent_before = sim.stats["sent"]
+    with contextlib.redirect_stdout(io.StringIO()):
+        published = sum(await asyncio.gather(*(publish(i, p) for i, p in enumerate(publishers))))
+    print(f"Published {published}/{args.records} records "
+          f"({(sim.stats['sent'] - sent_before) / args.records:.0f} messages per publish)")
+
+    if args.churn:
+        churned = int((len(sim.nodes) - 1) * args.churn)
+        sim.kill_nodes(churned)
+        await sim.start_nodes(churned)
+        print(f"Churn: replaced {churned} nodes ({args.churn:.0%})")
+
+    latencies, found = [], 0
+    remaining = args.lookups
+
+    async def lookup_worker(reader: Agent):
+        # Each worker owns a reader agent, so attach() doesn't race between lookups
+        nonlocal remaining, found
+        while remaining > 0:
+            remaining -= 1
+            publisher = random.choice(publishers)
+            sim.attach(reader)
+            start = time.perf_counter()
+            record = await reader.fetch_record(publisher.did)
+            latencies.append((time.perf_counter() - start) * 1000.0)
+            if record is not None and record.public_key_pem == publisher.public_key_pem:
+                found += 1
+
+    sent_before = sim.stats["sent"]
+    with contextlib.redirect_stdout(io.StringIO()):
+        await asyncio.gather(*(lookup_worker(reader) for reader in readers))
+
+    print(f"\n=== {args.lookups} lookups over {len(sim.nodes)} nodes ===")
+    print(f"success  {found / args.lookups:.1%}")
+    print(f"latency  p50={statistics.median(latencies):.2f}ms p99={percentile(latencies, 0.99):.2f}ms "
+          f"max={max(latencies):.2f}ms")
+    print(f"messages {(sim.stats['sent'] - sent_before) / args.lookups:.1f} per lookup, "
+          f"{sim.stats['dropped']} dropped in total")
+
+    # Let abandoned hedge/iterative lookups finish before their nodes go away
+    pending = asyncio.all_tasks() - {asyncio.current_task()}
+    if pending:
+        await asyncio.wait(pending, timeout=args.rpc_timeout * 2)
+    for node in sim.nodes.values():
+        node.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--nodes", type=int, default=200)
+    parser.add_argument("--records", type=int, default=20)
+    parser.add_argument("--lookups", type=int, default=200)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="one-way delay added to every datagram")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="extra uniform random delay")
+    parser.add_argument("--loss", type=float, default=0.0, help="probability a datagram is dropped")
+    parser.add_argument("--churn", type=float, default=0.0,
+                        help="fraction of nodes replaced between publishing and lookups")
+    parser.add_argument("--ksize", type=int, default=20)
+    parser.add_argument("--alpha", type=int, default=3)
+    parser.add_argument("--rpc-timeout", type=float, default=2.0)
+    parser.add_argument("--lookup-timeout", type=float, default=10.0)
+    parser.add_argument("--hedge", type=int, default=3)
+    parser.add_argument("--concurrency", type=int, default=16, help="lookups in flight at once")
+    parser.add_argument("--seed", type=int, default=1)
+    asyncio.run(main(parser.parse_args()))
@@ -28,7 +28,7 @@ async def main():
         agent.listen_and_join(http_host, http_port, dht_host, dht_port, bootstrap_node)
     )
 
-    await asyncio.sleep(2)  # Give time to join the network
+    await agent.wait_until_ready()
 
     # Register (not strictly needed for this test, but good practice)
     await agent.register(
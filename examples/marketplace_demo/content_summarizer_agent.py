@@ -85,7 +85,7 @@ async def main():
         agent.listen_and_join(http_host, http_port, dht_host, dht_port, bootstrap_node)
     )
 
-    await asyncio.sleep(2)
+    await agent.wait_until_ready()
 
     await agent.register(
         public_endpoint=f"http://{http_host}:{http_port}",
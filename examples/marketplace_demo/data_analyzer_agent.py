@@ -9,10 +9,11 @@ from pathlib import Path
 sys.path.insert(0, str(Path(__file__).parent.parent.parent))
 
 import asyncio
-from agent_web import Agent
+from agent_web import Agent, memoize_handler
 import statistics
 import json
 
+@memoize_handler(ttl=300)  # Same dataset + metric always yields the same analysis
 async def handle_analyze_request(sender_did: str, message_body: dict):
     """
     Analyze a dataset and return statistics
@@ -103,7 +104,7 @@ async def main():
         agent.listen_and_join(http_host, http_port, dht_host, dht_port, bootstrap_node)
     )
 
-    await asyncio.sleep(2)
+    await agent.wait_until_ready()
 
     await agent.register(
         public_endpoint=f"http://{http_host}:{http_port}",
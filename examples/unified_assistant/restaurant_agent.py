@@ -80,7 +80,7 @@ async def main():
             bootstrap_node=("127.0.0.1", 8480)
         )
     )
-    await asyncio.sleep(2)
+    await agent.wait_until_ready()
 
     await agent.register(
         public_endpoint="http://127.0.0.1:8017",
@@ -17,25 +17,8 @@ if 'agent' not in st.session_state:
         demo_mode=True
     )
 
-    async def start_agent():
-        listen_task = asyncio.create_task(
-            agent.listen_and_join(
-                http_host="127.0.0.1", http_port=8016,
-                dht_host="127.0.0.1", dht_port=8486,
-                bootstrap_node=("127.0.0.1", 8480)
-            )
-        )
-        await asyncio.sleep(2)
-
-        await agent.register(
-            public_endpoint="http://127.0.0.1:8016",
-            capabilities=["personal_assistant_ui"],
-            price=0.0,
-            payment_method="free"
-        )
-        return listen_task
-
-    st.session_state.listen_task = loop.run_until_complete(start_agent())
+    # The UI only sends requests, so it runs as a client: no listener, no DHT node
+    loop.run_until_complete(agent.start_client())
     st.session_state.agent = agent
     st.session_state.loop = loop
 
@@ -91,7 +74,8 @@ with col1:
                             "task": "find_flight",
                             "destination": destination,
                             "date": day
-                        }
+                        },
+                        timeout=15  # Shared by the whole chain: the travel agent's airline call inherits it
                     )
                 )
 
@@ -3,7 +3,8 @@ from pathlib import Path
 sys.path.insert(0, str(Path(__file__).parent.parent.parent))
 
 import asyncio
-from agent_web import Agent
+import hashlib
+from agent_web import Agent, current_idempotency_key
 
 travel_agent_sdk_instance = None
 
@@ -55,13 +56,24 @@ async def handle_travel_request(sender_did: str, message_body: dict):
         flight_id = message_body.get("flight_id")
         print(f"[TRAVEL AGENT] Booking flight: {flight_id}")
 
+        # The caller's retries of this request carry the same key, so forwarding
+        # a key derived from it reuses the first booking instead of double-booking.
+        # The airline sees every customer's booking as coming from us, so the
+        # customer's DID goes into the key: two customers picking the same key
+        # must not get each other's booking
+        incoming_key = current_idempotency_key()
+        booking_key = None
+        if incoming_key:
+            booking_key = hashlib.sha256(f"{sender_did}:{incoming_key}".encode("utf-8")).hexdigest()
+
         try:
             booking_response = await travel_agent_sdk_instance.execute_task(
                 capability="airline_book_ticket",
                 message_body={
                     "action": "book_ticket",
                     "flight_id": flight_id
-                }
+                },
+                idempotency_key=booking_key
             )
             return booking_response
         except Exception as e:
@@ -92,7 +104,7 @@ async def main():
     listen_task = asyncio.create_task(
         agent.listen_and_join(http_host, http_port, dht_host, dht_port, bootstrap_node)
     )
-    await asyncio.sleep(2)
+    await agent.wait_until_ready()
 
     await agent.register(
         public_endpoint=f"http://{http_host}:{http_port}",
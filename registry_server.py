@@ -1,8 +1,13 @@
 # registry_server.py
+import base64
+import json
+import time
 import uvicorn
 from fastapi import FastAPI, HTTPException
 from pydantic import BaseModel, computed_field
-from typing import List, Dict
+from typing import List, Dict, Optional
+
+from agent_web import _did_from_pem, _verify_signature
 
 # --- Pydantic Models ---
 
@@ -51,14 +56,46 @@ class ReputationRequest(BaseModel):
     # NEW: Model for batch reputation requests
     agent_ids: List[str]
 
+class AgentLoad(BaseModel):
+    # Latest heartbeat from an agent
+    in_flight: int = 0
+    queued: int = 0
+    p95_ms: float = 0.0
+    interval: float = 0.0
+    reported_at: float = 0.0
+
+class Heartbeat(BaseModel):
+    # A signed Payload (as in /invoke) whose body is the load report, plus the
+    # public key the sender's DID is derived from
+    payload: str
+    signature: str
+    public_key_pem: str
+
+class Candidate(BaseModel):
+    did: str
+    reputation: ReputationStats
+    load: Optional[AgentLoad] = None
+
 class ReputationResponse(BaseModel):
     # NEW: Model for batch reputation responses
     reputations: Dict[str, ReputationStats]
+    loads: Dict[str, AgentLoad] = {}  # Only agents with a fresh heartbeat
 
 # --- In-Memory "Databases" ---
 # AGENT_DB IS GONE! All agent data now lives on the DHT
 INDEX_DB: Dict[str, List[str]] = {}  # NEW: "capability" -> ["agent_id", ...]
 REPUTATION_DB: Dict[str, ReputationStats] = {}  # Unchanged
+LOAD_DB: Dict[str, AgentLoad] = {}  # "agent_id" -> latest heartbeat
+HEARTBEAT_TIMESTAMPS: Dict[str, float] = {}  # "agent_id" -> signed timestamp of that heartbeat
+
+HEARTBEAT_MAX_SKEW = 60.0  # Seconds a heartbeat's signed timestamp may be off from ours
+HEARTBEAT_MISSED = 3  # Heartbeat intervals without news before a load is considered stale
+
+def fresh_load(agent_id: str) -> Optional[AgentLoad]:
+    load = LOAD_DB.get(agent_id)
+    if load is None or time.time() - load.reported_at > HEARTBEAT_MISSED * load.interval:
+        return None
+    return load
 
 # --- SPRINT 9: DEMO MODE CACHE ---
 class AgentRecord(BaseModel):
@@ -67,6 +104,9 @@ class AgentRecord(BaseModel):
     public_key_pem: str
     capabilities: List[str]
     price: float
+    uds_path: Optional[str] = None
+    cacheable: bool = False
+    cache_ttl: float = 0.0
 
 AGENT_DATA_CACHE: Dict[str, AgentRecord] = {}
 
@@ -84,6 +124,14 @@ async def publish_record(record: AgentRecord):
     print(f"[DEMO CACHE] Published record for DID: {record.did} with capabilities: {record.capabilities}")
     return {"status": "cached", "did": record.did}
 
+@app.get("/records", response_model=List[AgentRecord])
+async def list_records():
+    """
+    All records in the central cache, for host-local snapshot sidecars
+    (see registry_snapshot.py).
+    """
+    return list(AGENT_DATA_CACHE.values())
+
 @app.get("/discover/{did}", response_model=AgentRecord)
 async def discover(did: str):
     """
@@ -95,20 +143,36 @@ async def discover(did: str):
     print(f"[DEMO CACHE] Discovered DID: {did}")
     return AGENT_DATA_CACHE[did]
 
+def index_capabilities(agent_id: str, capabilities: List[str]):
+    for capability in capabilities:
+        if capability not in INDEX_DB:
+            INDEX_DB[capability] = []
+        if agent_id not in INDEX_DB[capability]:
+            INDEX_DB[capability].append(agent_id)
+
 @app.post("/register_capabilities", status_code=201)
 async def register_capabilities(reg: AgentCapabilityRegistration):
     """
     Register an agent's capabilities in the index.
     Note: Agent data (endpoint, pubkey, price) is now stored on the DHT.
     """
-    for capability in reg.capabilities:
-        if capability not in INDEX_DB:
-            INDEX_DB[capability] = []
-        if reg.agent_id not in INDEX_DB[capability]:
-            INDEX_DB[capability].append(reg.agent_id)
+    index_capabilities(reg.agent_id, reg.capabilities)
     print(f"[INDEXER] Registered capabilities for: {reg.agent_id} - {reg.capabilities}")
     return {"status": "success", "agent_id": reg.agent_id}
 
+@app.post("/register_batch", status_code=201)
+async def register_batch(records: List[AgentRecord]):
+    """
+    Caches many records and indexes their capabilities in one call, as
+    /publish_record plus /register_capabilities would for each
+    (used by AgentHost.register_all).
+    """
+    for record in records:
+        AGENT_DATA_CACHE[record.did] = record
+        index_capabilities(record.did, record.capabilities)
+    print(f"[INDEXER] Registered a batch of {len(records)} agents")
+    return {"status": "success", "count": len(records)}
+
 @app.post("/report", status_code=200)
 async def report_transaction(report: TransactionReport):
     """
@@ -130,6 +194,37 @@ async def report_transaction(report: TransactionReport):
     print(f"[REPUTATION] Updated stats for {agent_id}: Success={stats.successes}/{stats.count}, AvgTime={stats.avg_response_time_ms:.1f}ms, Score={stats.reputation_score:.2f}")
     return {"status": "reputation_updated"}
 
+@app.post("/heartbeat", status_code=200)
+async def heartbeat(hb: Heartbeat):
+    """
+    Records an agent's current load. The payload must be signed by the key
+    its sender DID is derived from, and be newer than the last one accepted.
+    """
+    try:
+        payload_bytes = base64.b64decode(hb.payload)
+        payload = json.loads(payload_bytes)
+        agent_id, report, sent_at = payload["sender_did"], payload["body"], float(payload["timestamp"])
+        signature = base64.b64decode(hb.signature)
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Malformed heartbeat")
+    try:
+        verified = _did_from_pem(hb.public_key_pem) == agent_id and \
+            _verify_signature(payload_bytes, signature, hb.public_key_pem)
+    except ValueError:  # Not a PEM public key
+        verified = False
+    if not verified:
+        raise HTTPException(status_code=403, detail="Heartbeat signature does not match its DID")
+    if abs(time.time() - sent_at) > HEARTBEAT_MAX_SKEW or sent_at <= HEARTBEAT_TIMESTAMPS.get(agent_id, 0.0):
+        raise HTTPException(status_code=409, detail="Stale or replayed heartbeat")
+    try:
+        load = AgentLoad(in_flight=report["in_flight"], queued=report["queued"], p95_ms=report["p95_ms"],
+                         interval=min(max(float(report["interval"]), 1.0), 300.0), reported_at=time.time())
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Malformed load report")
+    HEARTBEAT_TIMESTAMPS[agent_id] = sent_at
+    LOAD_DB[agent_id] = load
+    return {"status": "ok"}
+
 @app.get("/search", response_model=List[str])
 async def search_by_capability(capability: str):
     """
@@ -141,17 +236,32 @@ async def search_by_capability(capability: str):
         print(f"[INDEXER] Found {len(matching_agents)} agents with capability '{capability}': {matching_agents}")
     return matching_agents
 
+@app.get("/candidates", response_model=List[Candidate])
+async def search_candidates(capability: str):
+    """
+    Like /search, but with each agent's reputation and latest load (if its
+    last heartbeat is recent), for callers ranking without a second round trip.
+    """
+    return [Candidate(did=agent_id, reputation=REPUTATION_DB.get(agent_id, ReputationStats()),
+                      load=fresh_load(agent_id))
+            for agent_id in INDEX_DB.get(capability, [])]
+
 @app.post("/get_reputations", response_model=ReputationResponse)
 async def get_reputations(req: ReputationRequest):
     """
-    Gets the latest reputation stats for a list of agents.
+    Gets the latest reputation stats for a list of agents, plus the load of
+    those with a recent heartbeat.
     """
     results = {}
+    loads = {}
     for agent_id in req.agent_ids:
         # Return default stats for any agent not yet in the DB
         results[agent_id] = REPUTATION_DB.get(agent_id, ReputationStats())
-    print(f"[REPUTATION] Returning reputation data for {len(results)} agents")
-    return ReputationResponse(reputations=results)
+        load = fresh_load(agent_id)
+        if load is not None:
+            loads[agent_id] = load
+    print(f"[REPUTATION] Returning reputation data for {len(results)} agents ({len(loads)} with load)")
+    return ReputationResponse(reputations=results, loads=loads)
 
 # Note: The /discover endpoint is DELETED - discovery now happens via DHT
 
@@ -0,0 +1,217 @@
+# registry_snapshot.py
+"""
+Host-local, memory-mapped snapshot of the registry's agent records.
+
+One sidecar per host fetches the registry's records and writes an immutable
+snapshot file; every Agent on the host maps the same file read-only
+(Agent(snapshot_path=...)), so lookups are a binary search over shared pages
+instead of a registry round trip, and keep working while the registry is down.
+
+File layout (big-endian):
+    header  magic "AWSNAP01" | record count (uint32) | created_at ms (uint64)
+    index   count x (sha256(DID) 32 bytes | data offset uint32 | data length uint32),
+            sorted by digest
+    data    per record: capabilities length (uint16) | capabilities, "\\n"-joined UTF-8 |
+            compact agent record (see agent_web._encode_record)
+
+Snapshots are replaced atomically (write + rename), so readers holding the old
+mapping are never disturbed and pick up the new file on their next check.
+
+Run the sidecar:
+    python registry_snapshot.py --registry http://127.0.0.1:8000 --path /dev/shm/agentweb.snap
+"""
+
+import argparse
+import asyncio
+import hashlib
+import mmap
+import os
+import struct
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import httpx
+
+from agent_web import AgentRecord, _encode_record, _decode_record, _did_from_pem
+
+MAGIC = b"AWSNAP01"
+_HEADER = struct.Struct(">8sIQ")
+_INDEX_ENTRY = struct.Struct(">32sII")
+_CAPS_LEN = struct.Struct(">H")
+
+
+def _did_digest(did: str) -> bytes:
+    return hashlib.sha256(did.encode("utf-8")).digest()
+
+
+def _encode_entry(did: str, record: AgentRecord, capabilities: List[str]) -> bytes:
+    """Data for one entry; raises ValueError unless the record decodes back to a key hashing to `did`."""
+    encoded = _encode_record(record)
+    if _did_from_pem(_decode_record(encoded).public_key_pem) != did:
+        raise ValueError("DID does not match the record's public key")
+    caps = "\n".join(capabilities).encode("utf-8")
+    return _CAPS_LEN.pack(len(caps)) + caps + encoded
+
+
+def write_snapshot(entries: Iterable[Tuple[str, AgentRecord, List[str]]], path: str) -> int:
+    """
+    Writes (did, record, capabilities) entries to `path` atomically; returns the count.
+    Entries that can't be encoded or don't match their DID are skipped (and logged),
+    since /publish_record accepts anything and one bad record mustn't stall every host.
+    """
+    blobs = []
+    for did, record, capabilities in entries:
+        try:
+            blobs.append((_did_digest(did), _encode_entry(did, record, capabilities)))
+        except (ValueError, TypeError, struct.error) as e:
+            print(f"[SNAPSHOT] WARN: Skipping record for {did[:40]}: {e}")
+    blobs.sort(key=lambda blob: blob[0])
+
+    offset = _HEADER.size + _INDEX_ENTRY.size * len(blobs)
+    index, data = bytearray(), bytearray()
+    for digest, blob in blobs:
+        index += _INDEX_ENTRY.pack(digest, offset + len(data), len(blob))
+        data += blob
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(_HEADER.pack(MAGIC, len(blobs), int(time.time() * 1000)))
+        f.write(index)
+        f.write(data)
+    os.replace(tmp_path, path)
+    return len(blobs)
+
+
+class RegistrySnapshot:
+    """Read-only view of a snapshot file; remaps automatically when the sidecar replaces it."""
+
+    def __init__(self, path: str, check_interval: float = 1.0):
+        self.path = path
+        self.check_interval = check_interval
+        self.count = 0
+        self.created_at = 0.0
+        self._mm: Optional[mmap.mmap] = None
+        self._identity = None  # (st_ino, st_mtime_ns) of the mapped file
+        self._next_check = 0.0
+        self._reload()
+
+    def _reload(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return  # No snapshot yet; keep the current mapping (if any)
+        identity = (stat.st_ino, stat.st_mtime_ns)
+        if identity == self._identity or stat.st_size < _HEADER.size:
+            return
+        with open(self.path, "rb") as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, count, created_ms = _HEADER.unpack_from(mm, 0)
+        if magic != MAGIC:
+            mm.close()
+            print(f"[SNAPSHOT] WARN: {self.path} is not a registry snapshot")
+            return
+        if self._mm is not None:
+            self._mm.close()
+        self._mm, self._identity = mm, identity
+        self.count, self.created_at = count, created_ms / 1000.0
+
+    def _maybe_reload(self):
+        now = time.monotonic()
+        if now >= self._next_check:
+            self._next_check = now + self.check_interval
+            self._reload()
+
+    def _entry(self, did: str) -> Optional[Tuple[int, int]]:
+        """Binary search of the index; returns (offset, length) of the record's data."""
+        digest = _did_digest(did)
+        low, high = 0, self.count
+        while low < high:
+            mid = (low + high) // 2
+            position = _HEADER.size + mid * _INDEX_ENTRY.size
+            key = self._mm[position:position + 32]
+            if key < digest:
+                low = mid + 1
+            elif key > digest:
+                high = mid
+            else:
+                _, offset, length = _INDEX_ENTRY.unpack_from(self._mm, position)
+                return offset, length
+        return None
+
+    def _capabilities(self, offset: int) -> List[str]:
+        caps_len, = _CAPS_LEN.unpack_from(self._mm, offset)
+        start = offset + _CAPS_LEN.size
+        caps = self._mm[start:start + caps_len].decode("utf-8")
+        return caps.split("\n") if caps else []
+
+    def _record(self, offset: int, length: int) -> AgentRecord:
+        caps_len, = _CAPS_LEN.unpack_from(self._mm, offset)
+        return _decode_record(self._mm[offset + _CAPS_LEN.size + caps_len:offset + length])
+
+    def lookup(self, did: str) -> Optional[AgentRecord]:
+        """Returns the snapshotted record for `did` (not yet DID-verified), or None."""
+        self._maybe_reload()
+        if self._mm is None:
+            return None
+        entry = self._entry(did)
+        return self._record(*entry) if entry else None
+
+    def search(self, capability: str) -> List[str]:
+        """DIDs offering `capability` (a scan; the index is keyed by DID only)."""
+        self._maybe_reload()
+        if self._mm is None:
+            return []
+        dids = []
+        for i in range(self.count):
+            _, offset, length = _INDEX_ENTRY.unpack_from(self._mm, _HEADER.size + i * _INDEX_ENTRY.size)
+            if capability in self._capabilities(offset):
+                dids.append(_did_from_pem(self._record(offset, length).public_key_pem))
+        return dids
+
+    def close(self):
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+
+
+def _from_registry(record_dict: Dict) -> Tuple[str, AgentRecord, List[str]]:
+    record = AgentRecord(
+        public_key_pem=record_dict["public_key_pem"],
+        endpoint=record_dict["endpoint"],
+        price=record_dict["price"],
+        payment_method="none",
+        uds_path=record_dict.get("uds_path"),
+        cacheable=record_dict.get("cacheable", False),
+        cache_ttl=record_dict.get("cache_ttl", 0.0)
+    )
+    return record_dict["did"], record, record_dict.get("capabilities", [])
+
+
+async def run_sidecar(registry_url: str, path: str, interval: float = 5.0):
+    """Refreshes the snapshot from the registry's GET /records every `interval` seconds."""
+    async with httpx.AsyncClient() as client:
+        while True:
+            try:
+                r = await client.get(f"{registry_url}/records", timeout=10)
+                r.raise_for_status()
+                entries = []
+                for record_dict in r.json():
+                    try:
+                        entries.append(_from_registry(record_dict))
+                    except (ValueError, KeyError, TypeError) as e:
+                        print(f"[SNAPSHOT] WARN: Skipping malformed registry record: {e}")
+                count = write_snapshot(entries, path)
+                print(f"[SNAPSHOT] Wrote {count} records to {path}")
+            except (httpx.HTTPError, ValueError, KeyError) as e:
+                # Keep serving the previous snapshot while the registry is unreachable
+                print(f"[SNAPSHOT] WARN: Refresh failed, keeping previous snapshot: {e}")
+            await asyncio.sleep(interval)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Keep a host-local registry snapshot up to date")
+    parser.add_argument("--registry", default="http://127.0.0.1:8000")
+    parser.add_argument("--path", default="agentweb_registry.snap")
+    parser.add_argument("--interval", type=float, default=5.0)
+    args = parser.parse_args()
+    asyncio.run(run_sidecar(args.registry, args.path, args.interval))